@@ -0,0 +1,176 @@
+"""
+レコメンド内容の重複排除（recommendation_payloads）のベンチマーク
+
+合成データで、JSONを行ごとに持つ従来のテーブルと、ハッシュで参照する現在のテーブルを比べる。
+・保存サイズ（SQLiteファイルのサイズとJSONの総バイト数）
+・/history と同じ形のクエリの読み込み時間
+
+    python benchmarks/bench_payload_dedup.py --rows 50000 --users 2000 --distinct 500
+"""
+import argparse
+import datetime
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import Column, DateTime, Index, JSON, MetaData, Table, create_engine, insert, select  # noqa: E402
+from sqlalchemy.dialects.postgresql import UUID  # noqa: E402
+from models import Base, RecommendationModel, RecommendationPayload  # noqa: E402
+from payloads import canonical_json, payload_hash  # noqa: E402
+
+# 重複排除前のスキーマ（JSONを行ごとに保存）
+inline_metadata = MetaData()
+inline_table = Table(
+    "recommendations",
+    inline_metadata,
+    Column("id", UUID(as_uuid=True), primary_key=True),
+    Column("user_id", UUID(as_uuid=True), nullable=False),
+    Column("recommendation", JSON, nullable=False),
+    Column("created_at", DateTime, nullable=False),
+    Index("ix_inline_user_id_created_at", "user_id", "created_at"),
+)
+
+
+def make_idea(i: int) -> dict:
+    return {
+        "title": f"ポートフォリオのお題 {i}",
+        "description": "初心者向けのWebアプリを作成し、学んだ内容をまとめます。" * 4,
+        "roadmap": [f"ステップ{n}: 基本を学ぶ" for n in range(6)],
+        "technologies": ["Python", "FastAPI", "PostgreSQL", "Next.js"],
+        "outcomes": ["API設計を理解する", "DB設計を理解する", "デプロイを経験する"],
+    }
+
+
+def make_dataset(rows: int, users: int, distinct: int, seed: int):
+    """
+    人気のアイデアほど何度も保存されるよう、内容はべき分布で選ぶ
+    """
+    rng = random.Random(seed)
+    ideas = [make_idea(i) for i in range(distinct)]
+    weights = [1 / (i + 1) for i in range(distinct)]
+    user_ids = [uuid.uuid4() for _ in range(users)]
+    base = datetime.datetime(2025, 1, 1)
+    data = []
+    for n in range(rows):
+        data.append({
+            "id": uuid.uuid4(),
+            "user_id": rng.choice(user_ids),
+            "recommendation": rng.choices(ideas, weights)[0],
+            "created_at": base + datetime.timedelta(seconds=n),
+        })
+    return data, user_ids
+
+
+def file_size(path: str) -> int:
+    return os.path.getsize(path)
+
+
+def load_inline(path: str, data) -> None:
+    engine = create_engine(f"sqlite:///{path}")
+    inline_metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(inline_table), data)
+    engine.dispose()
+
+
+def load_dedup(path: str, data) -> None:
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    payloads = {}
+    records = []
+    for row in data:
+        h = payload_hash(row["recommendation"])
+        payloads[h] = row["recommendation"]
+        records.append({
+            "id": row["id"],
+            "user_id": row["user_id"],
+            "payload_hash": h,
+            "created_at": row["created_at"],
+        })
+    with engine.begin() as conn:
+        conn.execute(insert(RecommendationPayload.__table__), [{"hash": h, "payload": p} for h, p in payloads.items()])
+        conn.execute(insert(RecommendationModel.__table__), records)
+    engine.dispose()
+
+
+def time_history(path: str, stmt_for_user, user_ids, queries: int, seed: int):
+    engine = create_engine(f"sqlite:///{path}")
+    rng = random.Random(seed)
+    timings = []
+    with engine.connect() as conn:
+        for _ in range(queries):
+            stmt = stmt_for_user(rng.choice(user_ids))
+            started = time.perf_counter()
+            conn.execute(stmt).all()
+            timings.append((time.perf_counter() - started) * 1000)
+    engine.dispose()
+    timings.sort()
+    return statistics.mean(timings), timings[len(timings) // 2], timings[int(len(timings) * 0.95)]
+
+
+def inline_history(user_id):
+    return (
+        select(inline_table.c.id, inline_table.c.user_id, inline_table.c.recommendation, inline_table.c.created_at)
+        .where(inline_table.c.user_id == user_id)
+        .order_by(inline_table.c.created_at.desc())
+    )
+
+
+def dedup_history(user_id):
+    return (
+        select(
+            RecommendationModel.id,
+            RecommendationModel.user_id,
+            RecommendationPayload.payload.label("recommendation"),
+            RecommendationModel.created_at,
+        )
+        .join(RecommendationPayload, RecommendationPayload.hash == RecommendationModel.payload_hash)
+        .where(RecommendationModel.user_id == user_id)
+        .order_by(RecommendationModel.created_at.desc())
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--distinct", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    data, user_ids = make_dataset(args.rows, args.users, args.distinct, args.seed)
+    distinct = {payload_hash(r["recommendation"]) for r in data}
+    json_bytes = sum(len(canonical_json(r["recommendation"]).encode("utf-8")) for r in data)
+    dedup_json_bytes = sum(
+        len(canonical_json(r["recommendation"]).encode("utf-8"))
+        for r in {payload_hash(r["recommendation"]): r for r in data}.values()
+    )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        inline_path = os.path.join(tmp, "inline.db")
+        dedup_path = os.path.join(tmp, "dedup.db")
+        load_inline(inline_path, data)
+        load_dedup(dedup_path, data)
+        inline_size = file_size(inline_path)
+        dedup_size = file_size(dedup_path)
+        inline_latency = time_history(inline_path, inline_history, user_ids, args.queries, args.seed)
+        dedup_latency = time_history(dedup_path, dedup_history, user_ids, args.queries, args.seed)
+
+    print(f"rows={args.rows} users={args.users} distinct payloads={len(distinct)}")
+    print(f"{'':<10}{'db size (KB)':>14}{'json (KB)':>12}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    print(f"{'inline':<10}{inline_size / 1024:>14.0f}{json_bytes / 1024:>12.0f}"
+          f"{inline_latency[0]:>10.3f}{inline_latency[1]:>10.3f}{inline_latency[2]:>10.3f}")
+    print(f"{'dedup':<10}{dedup_size / 1024:>14.0f}{dedup_json_bytes / 1024:>12.0f}"
+          f"{dedup_latency[0]:>10.3f}{dedup_latency[1]:>10.3f}{dedup_latency[2]:>10.3f}")
+    print(f"db size saved: {(1 - dedup_size / inline_size) * 100:.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+プロファイリング用ミドルウェアのオーバーヘッドのベンチマーク
+
+ASGIアプリを直接呼び出して、1リクエストあたりの処理時間を比べる。
+none と idle はラウンドごとに交互に（順番も入れ替えて）実行し、
+CPUの周波数やキャッシュの状態の変化がどちらか一方に偏らないようにする。
+・none:     ミドルウェアなし（PROFILING_TOKEN / PROFILING_SAMPLE_RATE 未設定時の本番と同じ）
+・idle:     ミドルウェアあり、ヘッダーなしで計測対象外のリクエスト
+・profiled: ミドルウェアあり、ヘッダー付きで計測したリクエスト（参考）
+
+    python benchmarks/bench_profiling_overhead.py --rounds 20 --requests 1000
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi import FastAPI  # noqa: E402
+from profiling import ProfileStore, ProfilingMiddleware  # noqa: E402
+
+TOKEN = "bench-token"
+
+
+def make_app(store=None) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/history")
+    def history():
+        return {"history": [{"id": i, "recommendation": {"title": "お題"}} for i in range(20)]}
+
+    if store is not None:
+        app.add_middleware(ProfilingMiddleware, store=store, token=TOKEN, sample_rate=0.0)
+    return app
+
+
+def make_scope(headers):
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/history",
+        "raw_path": b"/history",
+        "root_path": "",
+        "query_string": b"",
+        "headers": headers,
+        "client": ("127.0.0.1", 12345),
+        "server": ("127.0.0.1", 8000),
+    }
+
+
+async def run(app, headers, requests: int):
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    timings = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        await app(make_scope(headers), receive, send)
+        timings.append((time.perf_counter() - started) * 1_000_000)
+    return timings
+
+
+def summarize(label, timings):
+    timings = sorted(timings)
+    mean = statistics.mean(timings)
+    print(f"{label:<10}{mean:>10.1f}{timings[len(timings) // 2]:>10.1f}{timings[int(len(timings) * 0.95)]:>10.1f}")
+    return mean
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=1000, help="1ラウンドあたりのリクエスト数")
+    parser.add_argument("--profiled-requests", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = ProfileStore(tmp, max_files=10)
+        plain = make_app()
+        wrapped = make_app(store)
+        base_headers = [(b"host", b"localhost"), (b"authorization", b"Bearer token")]
+        debug_headers = base_headers + [(b"x-debug-profile", TOKEN.encode())]
+
+        # ウォームアップ
+        asyncio.run(run(plain, base_headers, 200))
+        asyncio.run(run(wrapped, base_headers, 200))
+
+        timings = {"none": [], "idle": []}
+        # ラウンドごとの p50 の差（idle - none）
+        diffs = []
+        for i in range(args.rounds):
+            variants = [("none", plain), ("idle", wrapped)]
+            if i % 2:
+                variants.reverse()
+            medians = {}
+            for label, app in variants:
+                round_timings = asyncio.run(run(app, base_headers, args.requests))
+                timings[label].extend(round_timings)
+                medians[label] = statistics.median(round_timings)
+            diffs.append(medians["idle"] - medians["none"])
+        profiled = asyncio.run(run(wrapped, debug_headers, args.profiled_requests))
+
+    print(f"{'':<10}{'mean us':>10}{'p50 us':>10}{'p95 us':>10}")
+    summarize("none", timings["none"])
+    summarize("idle", timings["idle"])
+    summarize("profiled", profiled)
+    diffs.sort()
+    q1, median, q3 = statistics.quantiles(diffs, n=4) if len(diffs) > 1 else (diffs[0],) * 3
+    print(
+        f"idle overhead (p50 difference, {args.rounds} rounds): median {median:+.2f} us/request, "
+        f"IQR [{q1:+.2f}, {q3:+.2f}], range [{diffs[0]:+.2f}, {diffs[-1]:+.2f}]"
+    )
+    print(f"relative to none p50: {median / statistics.median(timings['none']) * 100:+.2f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+レコメンド詳細の読み込みキャッシュ
+
+保存済みのレコメンド内容は変更されないため、id をキーに (所有者, 内容) を保持する。
+所有者も一緒に持つので、キャッシュにヒットした場合もDBを見ずに権限を確認できる。
+
+キャッシュはプロセスごとに持つため、APIサーバーは1ワーカーで動かすことを前提にしている。
+レコメンドを削除する処理を追加する場合は invalidate を呼ぶこと（ただし消えるのは
+そのワーカーのキャッシュだけ）。partitions.py でアーカイブした行もキャッシュには残る。
+複数ワーカーにする場合は RECOMMENDATION_CACHE_SIZE=0 で無効にするか、共有のキャッシュに置き換えること。
+"""
+import threading
+from collections import OrderedDict
+from os import getenv
+from typing import Optional, Tuple
+from uuid import UUID
+
+RECOMMENDATION_CACHE_SIZE = int(getenv("RECOMMENDATION_CACHE_SIZE", "1024"))
+
+
+class RecommendationCache:
+    """
+    件数上限付きのLRUキャッシュ
+    """
+
+    def __init__(self, max_size: int = RECOMMENDATION_CACHE_SIZE):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, rec_id: UUID) -> Optional[Tuple[UUID, dict]]:
+        with self._lock:
+            entry = self._entries.get(rec_id)
+            if entry is not None:
+                self._entries.move_to_end(rec_id)
+            return entry
+
+    def put(self, rec_id: UUID, owner_id: UUID, recommendation: dict) -> None:
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[rec_id] = (owner_id, recommendation)
+            self._entries.move_to_end(rec_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, rec_id: UUID) -> None:
+        with self._lock:
+            self._entries.pop(rec_id, None)
@@ -0,0 +1,64 @@
+import os
+import uuid
+import pytest
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import create_engine, make_url, text
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+@pytest.fixture
+def postgres_url():
+    """
+    TEST_POSTGRES_URL のサーバーにテストごとの空のデータベースを作って URL を返す（未設定ならスキップ）
+    開発用のデータを消さないよう、TEST_POSTGRES_URL のデータベース自体には触らない
+    """
+    url = os.getenv("TEST_POSTGRES_URL")
+    if not url:
+        pytest.skip("TEST_POSTGRES_URL が未設定")
+    name = f"pytest_{uuid.uuid4().hex[:12]}"
+    admin = create_engine(url, isolation_level="AUTOCOMMIT")
+    with admin.connect() as conn:
+        conn.execute(text(f'CREATE DATABASE "{name}"'))
+    yield make_url(url).set(database=name).render_as_string(hide_password=False)
+    with admin.connect() as conn:
+        conn.execute(text(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)'))
+    admin.dispose()
+
+@pytest.fixture
+def upgrade_database(monkeypatch):
+    """
+    指定したDBに alembic upgrade head を実行する関数
+    """
+    def upgrade(url):
+        monkeypatch.setenv("DATABASE_URL", url)
+        config = Config(os.path.join(HERE, "alembic.ini"))
+        config.set_main_option("script_location", os.path.join(HERE, "migrations"))
+        command.upgrade(config, "head")
+
+    return upgrade
+
+@pytest.fixture
+def mock_auth(monkeypatch):
+    """
+    /auth/me が指定したユーザーIDを返すようにする関数
+    """
+    def login(user_id):
+        monkeypatch.setenv("AUTH_URL", "http://mock-auth-url")
+
+        def mock_get(url, headers):
+            class MockResponse:
+                def __init__(self, json_data, status_code):
+                    self.json_data = json_data
+                    self.status_code = status_code
+
+                def json(self):
+                    return self.json_data
+
+            if url == "http://mock-auth-url/auth/me":
+                return MockResponse({"user": {"userId": user_id}}, 200)
+            return MockResponse(None, 404)
+
+        monkeypatch.setattr("requests.get", mock_get)
+
+    return login
@@ -0,0 +1,229 @@
+"""
+DeepSeek API の呼び出し
+
+上流のレスポンスをストリームで受け取り、JSONの回答が閉じた時点で接続を切る。
+接続を閉じると上流のサーバー側で生成が中断され、GPUが次のリクエストに回る。
+"""
+import json
+import threading
+import time
+from os import getenv
+from typing import Optional, Tuple
+import requests
+from urllib3.exceptions import ReadTimeoutError
+
+# 1リクエストで生成させる最大トークン数（ストリームのチャンク数で数える）
+DEEPSEEK_MAX_TOKENS = int(getenv("DEEPSEEK_MAX_TOKENS", "4096"))
+# 1リクエストにかける最大秒数
+DEEPSEEK_MAX_SECONDS = float(getenv("DEEPSEEK_MAX_SECONDS", "180"))
+DEEPSEEK_CONNECT_TIMEOUT = 10
+# トークン数・時間の上限で打ち切った場合の停止理由
+TRUNCATED_STOP_REASONS = ("max_tokens", "timeout")
+
+
+class DeepSeekError(Exception):
+    def __init__(self, message: str, details: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.details = details
+
+
+_metrics_lock = threading.Lock()
+_metrics = {
+    "requests": 0,
+    "tokens_generated": 0,
+    "tokens_below_budget": 0,
+    "stop_reasons": {},
+}
+
+
+def record_generation(tokens: int, max_tokens: int, stop_reason: str) -> None:
+    with _metrics_lock:
+        _metrics["requests"] += 1
+        _metrics["tokens_generated"] += tokens
+        if stop_reason == "json_complete":
+            # JSONが閉じた時点で残っていた上限までのトークン数
+            # 打ち切らなくてもモデルはすぐ止まったかもしれないので、節約できた量ではなく上限値
+            _metrics["tokens_below_budget"] += max(max_tokens - tokens, 0)
+        _metrics["stop_reasons"][stop_reason] = _metrics["stop_reasons"].get(stop_reason, 0) + 1
+
+
+def get_metrics() -> dict:
+    with _metrics_lock:
+        return {**_metrics, "stop_reasons": dict(_metrics["stop_reasons"])}
+
+
+def _balanced_json_end(text: str, start: int) -> Optional[int]:
+    """
+    text[start] の '{' または '[' に対応する閉じ括弧の位置を返す（文字列中の括弧は無視）
+    """
+    depth = 0
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        c = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif c == "\\":
+                escaped = True
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+        elif c in "{[":
+            depth += 1
+        elif c in "}]":
+            depth -= 1
+            if depth == 0:
+                return i
+    return None
+
+
+def find_complete_json(text: str, require_think_end: bool = True) -> Optional[str]:
+    """
+    生成テキストから完結したJSON（オブジェクトまたは配列）の文字列を探す
+    思考中（</think> の前）の下書きを拾わないよう、既定では </think> 以降だけを見る
+    """
+    if "</think>" in text:
+        region = text.rsplit("</think>", 1)[1]
+    elif require_think_end:
+        return None
+    else:
+        region = text
+
+    # ```json ... ``` で囲まれている場合
+    pos = region.find("```json")
+    while pos != -1:
+        body_start = pos + len("```json")
+        body_end = region.find("```", body_start)
+        if body_end == -1:
+            return None
+        candidate = region[body_start:body_end].strip()
+        try:
+            json.loads(candidate)
+            return candidate
+        except ValueError:
+            pos = region.find("```json", body_end + 3)
+
+    # 囲まれていない場合は最初の括弧から対応する閉じ括弧までを見る
+    starts = [i for i in (region.find("{"), region.find("[")) if i != -1]
+    if not starts:
+        return None
+    start = min(starts)
+    end = _balanced_json_end(region, start)
+    if end is None:
+        return None
+    candidate = region[start:end + 1]
+    try:
+        json.loads(candidate)
+        return candidate
+    except ValueError:
+        return None
+
+
+def strip_prompt_echo(raw_text: str, prompt: str) -> str:
+    """
+    上流サーバーはプロンプトを先頭に付けて返すため、その部分を取り除く
+    （プロンプト中の出力フォーマットの例を回答と取り違えないように）
+    """
+    if prompt:
+        pos = raw_text.find(prompt)
+        if pos != -1:
+            return raw_text[pos + len(prompt):]
+    return raw_text
+
+
+def extract_json_text(raw_text: str, prompt: str = "", stop_reason: str = "eos") -> str:
+    """
+    生成テキスト全体から回答のJSON文字列を取り出す
+    上限で打ち切られて </think> 以降に完結したJSONがない場合は DeepSeekError
+    """
+    text = strip_prompt_echo(raw_text, prompt)
+    json_text = find_complete_json(text)
+    if json_text:
+        return json_text
+    if stop_reason in TRUNCATED_STOP_REASONS or ("<think>" in text and "</think>" not in text):
+        # 思考の途中で終わっているので、下書きのJSONを回答として扱わない
+        raise DeepSeekError(
+            "DeepSeek generation stopped before the answer was complete.",
+            f"stop_reason: {stop_reason}",
+        )
+    json_text = find_complete_json(text, require_think_end=False)
+    if json_text:
+        return json_text
+    if "```json" in text:
+        # 想定通り返ってきた場合
+        return text.split("```json")[-1].split("```", 1)[0].strip()
+    if "</think>" in text:
+        # ないの場合、直接JSONとして解析
+        return text.split("</think>")[1].strip()
+    return text.strip()
+
+
+def generate(prompt: str, max_tokens: Optional[int] = None, max_seconds: Optional[float] = None) -> Tuple[str, str]:
+    """
+    DeepSeek にプロンプトを送り、生成テキストと停止理由を返す
+    JSONが閉じた時点、またはトークン数・時間の上限に達した時点で打ち切る
+    """
+    max_tokens = max_tokens or DEEPSEEK_MAX_TOKENS
+    max_seconds = max_seconds or DEEPSEEK_MAX_SECONDS
+    started = time.monotonic()
+    try:
+        response = requests.post(
+            f"{getenv('DEEPSEEK_URL')}:8000/response",
+            json={"text": prompt, "stream": True, "max_new_tokens": max_tokens},
+            stream=True,
+            timeout=(DEEPSEEK_CONNECT_TIMEOUT, max_seconds),
+        )
+    except requests.RequestException as e:
+        raise _request_failed(e, 0, max_tokens)
+    chunks = []
+    tokens = 0
+    try:
+        if response.status_code != 200:
+            record_generation(0, max_tokens, "http_error")
+            raise DeepSeekError(
+                f"Failed to fetch from DeepSeek API. Status Code: {response.status_code}",
+                response.text,
+                response.status_code,
+            )
+        if response.headers.get("Content-Type", "").startswith("application/json"):
+            # ストリーミング非対応のサーバーは {"response": "全体のテキスト..."} を返す
+            raw_text = response.json().get("response", "")
+            record_generation(0, max_tokens, "not_streamed")
+            return raw_text, "not_streamed"
+
+        response.encoding = response.encoding or "utf-8"
+        stop_reason = "eos"
+        for chunk in response.iter_content(chunk_size=None, decode_unicode=True):
+            chunks.append(chunk)
+            tokens += 1
+            # 閉じ括弧やフェンスが来たときだけ全体を走査する
+            if ("}" in chunk or "]" in chunk or "`" in chunk) and find_complete_json("".join(chunks)):
+                stop_reason = "json_complete"
+                break
+            if tokens >= max_tokens:
+                stop_reason = "max_tokens"
+                break
+            if time.monotonic() - started >= max_seconds:
+                stop_reason = "timeout"
+                break
+        record_generation(tokens, max_tokens, stop_reason)
+        return "".join(chunks), stop_reason
+    except requests.RequestException as e:
+        raise _request_failed(e, tokens, max_tokens)
+    finally:
+        # 途中で抜けた場合も接続を閉じて、上流に生成の中止を伝える
+        response.close()
+
+
+def _request_failed(e: requests.RequestException, tokens: int, max_tokens: int) -> DeepSeekError:
+    """
+    接続・読み込みのエラーを記録して DeepSeekError に変換する
+    GPUの順番待ちや生成の停止で読み込みがタイムアウトした場合は timeout として数える
+    """
+    # ストリームの読み込み中のタイムアウトは ConnectionError(ReadTimeoutError) として送出される
+    timed_out = isinstance(e, requests.Timeout) or any(isinstance(arg, ReadTimeoutError) for arg in e.args)
+    record_generation(tokens, max_tokens, "timeout" if timed_out else "connection_error")
+    return DeepSeekError("Failed to fetch from DeepSeek API.", str(e))
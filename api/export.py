@@ -0,0 +1,110 @@
+import csv
+import io
+import json
+import zlib
+from os import getenv
+from typing import Iterable, Iterator
+from sqlalchemy import and_, or_
+from models import RecommendationModel
+
+# 1回のフェッチでDBから取り出す行数（サーバーサイドカーソルのバッチサイズ）
+EXPORT_BATCH_SIZE = int(getenv("EXPORT_BATCH_SIZE", "500"))
+
+CSV_COLUMNS = ["id", "user_id", "created_at", "recommendation"]
+
+
+def serialize_row(rec) -> dict:
+    """
+    エクスポート用に1行を辞書へ変換
+    """
+    return {
+        "id": str(rec.id),
+        "user_id": str(rec.user_id),
+        "created_at": rec.created_at.isoformat() if rec.created_at else None,
+        "recommendation": rec.recommendation,
+    }
+
+
+def apply_checkpoint(query, after_created_at=None, after_id=None):
+    """
+    (created_at, id) のチェックポイントより後の行だけに絞り込む（キーセットページング）
+    """
+    if after_created_at is None:
+        return query
+    if after_id is None:
+        return query.filter(RecommendationModel.created_at > after_created_at)
+    return query.filter(
+        or_(
+            RecommendationModel.created_at > after_created_at,
+            and_(
+                RecommendationModel.created_at == after_created_at,
+                RecommendationModel.id > after_id,
+            ),
+        )
+    )
+
+
+def iter_rows(query, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[dict]:
+    """
+    サーバーサイドカーソルで少しずつ行を取り出す
+    チェックポイントから再開できるよう (created_at, id) の昇順で返す
+    """
+    query = query.order_by(
+        RecommendationModel.created_at.asc(),
+        RecommendationModel.id.asc(),
+    ).yield_per(batch_size)
+    for rec in query:
+        yield serialize_row(rec)
+
+
+def ndjson_chunks(rows: Iterable[dict], batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[bytes]:
+    """
+    NDJSON形式でバッチ単位のチャンクを返す
+    """
+    buf = []
+    for row in rows:
+        buf.append(json.dumps(row, ensure_ascii=False))
+        if len(buf) >= batch_size:
+            yield ("\n".join(buf) + "\n").encode("utf-8")
+            buf = []
+    if buf:
+        yield ("\n".join(buf) + "\n").encode("utf-8")
+
+
+def csv_chunks(rows: Iterable[dict], batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[bytes]:
+    """
+    CSV形式でバッチ単位のチャンクを返す
+    recommendation 列はJSON文字列として出力する
+    """
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(CSV_COLUMNS)
+    count = 0
+    for row in rows:
+        writer.writerow([
+            row["id"],
+            row["user_id"],
+            row["created_at"],
+            json.dumps(row["recommendation"], ensure_ascii=False),
+        ])
+        count += 1
+        if count >= batch_size:
+            yield out.getvalue().encode("utf-8")
+            out.seek(0)
+            out.truncate(0)
+            count = 0
+    if out.tell():
+        yield out.getvalue().encode("utf-8")
+
+
+def gzip_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """
+    チャンクを逐次gzip圧縮する（全体をメモリに載せない）
+    """
+    # wbits=31 で gzip ヘッダ付きのストリームになる
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
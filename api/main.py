@@ -3,13 +3,24 @@ from typing import List, Optional
 from pydantic import BaseModel, UUID4
 from dotenv import load_dotenv
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, FileResponse
 import requests
 import json
 from sqlalchemy.orm import Session
-from database import get_db
-from models import RecommendationModel
+from database import get_db, engine
+from models import RecommendationModel, RecommendationPayload
+from payloads import store_payload
 from os import getenv
 from uuid import UUID
+from datetime import datetime
+from contextlib import asynccontextmanager, suppress
+import asyncio
+from export import apply_checkpoint, iter_rows, ndjson_chunks, csv_chunks, gzip_chunks
+from partitions import ensure_future_partitions, ensure_partitions_periodically, hot_cutoff
+from deepseek import DeepSeekError, generate, extract_json_text, get_metrics
+from profiling import ProfileStore, ProfilingMiddleware, profiling_enabled
+from reservoir import IdeaReservoir, ideas_per_call, profile_key, validate_idea
+from cache import RecommendationCache
 """
 from transformers import AutoTokenizer, AutoModel
 import torch
@@ -39,7 +50,17 @@ class submit_data(BaseModel):
     interestFields: List[str]
     accessToken: Optional[str] = None
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 起動時と、その後も定期的に先の月のパーティションを作成（Postgres以外では何もしない）
+    ensure_future_partitions(engine)
+    ensure_task = asyncio.create_task(ensure_partitions_periodically(engine))
+    yield
+    ensure_task.cancel()
+    with suppress(asyncio.CancelledError):
+        await ensure_task
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -50,62 +71,89 @@ app.add_middleware(
     expose_headers=["*"]
 )
 
+profile_store = ProfileStore()
+idea_reservoir = IdeaReservoir()
+recommendation_cache = RecommendationCache()
+if profiling_enabled():
+    # 無効時はミドルウェア自体を登録しない
+    app.add_middleware(ProfilingMiddleware, store=profile_store)
+
 @app.get("/")
 async def root():
     return {"message": "Hello World"}
 
-@app.post("/submit_deepseek")
-def recommend_deepseek(data: submit_data,db: Session = Depends(get_db)):
-    print(f"data:{data}")
-    single_string = (
+def build_prompt(data: submit_data, ideas: int = 1) -> str:
+    """
+    DeepSeek に渡すプロンプト。ideas が2以上なら複数のアイデアをJSON配列で出させる
+    """
+    if ideas == 1:
+        output_format = '{"title": "string", "description": "string", "roadmap": ["string"], "technologies": ["string"], "outcomes": ["string"]}.'
+        count = "単一のアイデアを出してください。"
+    else:
+        output_format = '[{"title": "string", "description": "string", "roadmap": ["string"], "technologies": ["string"], "outcomes": ["string"]}].'
+        count = f"互いに異なる{ideas}個のアイデアをJSON配列で出してください。"
+    return (
         "以下の内容に関して、日本語でJSON形式で答えてください。"
         "出力フォーマットは以下のようにしてください:"
-        '{"title": "string", "description": "string", "roadmap": ["string"], "technologies": ["string"], "outcomes": ["string"]}.'
+        f"{output_format}"
         f"使いたい言語: {data.programmingLanguage}, "
         f"エンジニアのタイプ: {data.engineerType}, "
         f"興味のある分野: {', '.join(data.interestFields)}, "
         f"作品の難易度: {data.learningPreference} "
-        "出力してもらいたい内容は初心者がエンジニアとしてのポートフォリオを作成する際のお題を作ってほしいです.単一のアイデアを出してください。また学習ロードマップに関して、初心者がわからない用語は使わないでください"
+        f"出力してもらいたい内容は初心者がエンジニアとしてのポートフォリオを作成する際のお題を作ってほしいです.{count}また学習ロードマップに関して、初心者がわからない用語は使わないでください"
         "必ず、```jsonと```で囲んでjsonだけを出力してください。"
     )
-    
-    response = requests.post(f"{getenv("DEEPSEEK_URL")}:8000/response", json={"text": single_string})
-    if response.status_code != 200:
-        return {
-            "error": f"Failed to fetch from DeepSeek API. Status Code: {response.status_code}",
-            "details": response.text
-        }
-    
-    response_json = response.json()
-    # DeepSeek のレスポンスは {"response": "全体のテキスト..."} の形式を想定
-    raw_text = response_json.get("response", "")
-    
-    if "```json" in raw_text:
-        # 想定通り返ってきた場合
-        json_text = raw_text.split("```json")[2].split("```", 1)[0].strip()
-    else:
-        # ないの場合、直接JSONとして解析
-        json_text = raw_text.split("</think>")[1].strip()
-        json_text = json_text.strip()
-    if json_text:
-        parsed_data = json.loads(json_text)
-    else:
-        raise ValueError("Failed to parse JSON response from DeepSeek API.")
+
+@app.post("/submit_deepseek")
+def recommend_deepseek(data: submit_data,db: Session = Depends(get_db)):
+    print(f"data:{data}")
+    user_id = None
     if data.accessToken:
+        # LLMを呼ぶ前にトークンを確認する（出したアイデアの重複チェックにも使う）
         me_response = requests.get(f"{getenv('AUTH_URL')}/auth/me", headers={"Authorization": f"Bearer {data.accessToken}"})
         if me_response.status_code != 200:
             raise HTTPException(status_code=401, detail="Invalid access token")
         me_response_data = me_response.json()
         user_id = me_response_data.get('user',{}).get("userId")
-        uuid_user_id = UUID(user_id)
-        if uuid_user_id:
-            db_rec = RecommendationModel(user_id=uuid_user_id, recommendation=parsed_data)
-            db.add(db_rec)
-            db.commit()
-            db.refresh(db_rec)
-        return parsed_data
-    else:
-        return parsed_data
+
+    key = profile_key(data.engineerType, data.programmingLanguage, data.learningPreference, data.interestFields)
+    parsed_data = idea_reservoir.take(key, user_id)
+    if parsed_data is None:
+        ideas = ideas_per_call()
+        prompt = build_prompt(data, ideas)
+        try:
+            raw_text, stop_reason = generate(prompt)
+            json_text = extract_json_text(raw_text, prompt, stop_reason)
+        except DeepSeekError as e:
+            return {
+                "error": str(e),
+                "details": e.details
+            }
+        if json_text:
+            parsed_data = json.loads(json_text)
+        else:
+            raise ValueError("Failed to parse JSON response from DeepSeek API.")
+        if ideas == 1:
+            idea_reservoir.mark_served(user_id, parsed_data)
+        else:
+            candidates = parsed_data if isinstance(parsed_data, list) else [parsed_data]
+            parsed_data = idea_reservoir.pick(key, [c for c in candidates if validate_idea(c)], user_id)
+            if parsed_data is None:
+                raise ValueError("Failed to parse JSON response from DeepSeek API.")
+
+    if user_id:
+        db_rec = RecommendationModel(user_id=UUID(user_id), payload_hash=store_payload(db, parsed_data))
+        db.add(db_rec)
+        db.commit()
+        db.refresh(db_rec)
+    return parsed_data
+
+@app.get("/metrics/deepseek")
+def deepseek_metrics():
+    """
+    DeepSeek 呼び出しの打ち切り理由と上限までの残りトークン数、アイデアの取り置きの状況
+    """
+    return {**get_metrics(), "reservoir": idea_reservoir.stats()}
 
 @app.get("/history")
 def get_user_history(request: Request, db: Session = Depends(get_db)):
@@ -124,18 +172,138 @@ def get_user_history(request: Request, db: Session = Depends(get_db)):
         user_id = me_response_data.get('user',{}).get("userId")
         if not user_id:
             raise HTTPException(status_code=401, detail="Invalid access token")
-        history = (
-            db.query(RecommendationModel).
-            filter(RecommendationModel.user_id == user_id).
-            order_by(RecommendationModel.created_at.desc()).
-            all()
+        query = (
+            db.query(
+                RecommendationModel.id,
+                RecommendationModel.user_id,
+                RecommendationPayload.payload.label("recommendation"),
+                RecommendationModel.created_at,
+            ).
+            join(RecommendationPayload, RecommendationPayload.hash == RecommendationModel.payload_hash).
+            filter(RecommendationModel.user_id == user_id)
         )
-        return {"history":history}
+        cutoff = hot_cutoff()
+        if cutoff is not None:
+            # 保持期間内のパーティションだけを検索対象にする（復元した古い月も含めない）
+            query = query.filter(RecommendationModel.created_at >= cutoff)
+        history = query.order_by(RecommendationModel.created_at.desc()).all()
+        return {"history": [
+            {"id": h.id, "user_id": h.user_id, "recommendation": h.recommendation, "created_at": h.created_at}
+            for h in history
+        ]}
     except HTTPException as e:
         raise e
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+def get_current_user_id(request: Request) -> str:
+    """
+    Authorizationヘッダーのトークンから認証APIでユーザーIDを取得
+    """
+    auth_header = request.headers.get("Authorization")
+    if not auth_header:
+        raise HTTPException(status_code=401, detail="Authorization header is missing.")
+    accessToken = auth_header.split(" ")[1]
+    response = requests.get(f"{getenv('AUTH_URL')}/auth/me", headers={"Authorization": f"Bearer {accessToken}"})
+    if response.status_code != 200:
+        raise HTTPException(status_code=401, detail="Invalid access token")
+    me_response_data = response.json()
+    user_id = me_response_data.get('user',{}).get("userId")
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Invalid access token")
+    return user_id
+
+def is_admin(user_id: str) -> bool:
+    """
+    ADMIN_USER_IDS（カンマ区切り）に含まれるユーザーを管理者とみなす
+    """
+    admin_ids = [i.strip() for i in getenv("ADMIN_USER_IDS", "").split(",") if i.strip()]
+    return user_id in admin_ids
+
+@app.get("/history/export")
+def export_user_history(
+    request: Request,
+    format: str = "ndjson",
+    compress: bool = False,
+    all_users: bool = False,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    after_created_at: Optional[datetime] = None,
+    after_id: Optional[UUID4] = None,
+    db: Session = Depends(get_db),
+):
+    """
+    レコメンド履歴をNDJSON/CSVでストリーミング出力
+    ・all_users=true は管理者のみ（start/endで期間指定）
+    ・after_created_at/after_id で前回のチェックポイントから再開できる
+    """
+    user_id = get_current_user_id(request)
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'csv'.")
+    if all_users and not is_admin(user_id):
+        raise HTTPException(status_code=403, detail="Forbidden: Admin only.")
+
+    query = db.query(RecommendationModel)
+    if not all_users:
+        query = query.filter(RecommendationModel.user_id == UUID(user_id))
+    if start is not None:
+        query = query.filter(RecommendationModel.created_at >= start)
+    if end is not None:
+        query = query.filter(RecommendationModel.created_at < end)
+    query = apply_checkpoint(query, after_created_at, after_id)
+
+    def generate():
+        # get_db の後始末はレスポンス送信前に走るため、ストリームの終了時にもセッションを閉じる
+        try:
+            rows = iter_rows(query)
+            chunks = ndjson_chunks(rows) if format == "ndjson" else csv_chunks(rows)
+            if compress:
+                chunks = gzip_chunks(chunks)
+            yield from chunks
+        finally:
+            db.close()
+
+    filename = f"recommendations.{format}"
+    media_type = "application/x-ndjson" if format == "ndjson" else "text/csv"
+    if compress:
+        filename += ".gz"
+        media_type = "application/gzip"
+    return StreamingResponse(
+        generate(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@app.get("/admin/profiles")
+def list_profiles(request: Request):
+    """
+    保存されているプロファイル結果の一覧（管理者のみ）
+    """
+    if not is_admin(get_current_user_id(request)):
+        raise HTTPException(status_code=403, detail="Forbidden: Admin only.")
+    return {"profiles": profile_store.list()}
+
+@app.get("/admin/profiles/{name}")
+def download_profile(request: Request, name: str):
+    """
+    プロファイル結果（pstats形式）をダウンロード（管理者のみ）
+    """
+    if not is_admin(get_current_user_id(request)):
+        raise HTTPException(status_code=403, detail="Forbidden: Admin only.")
+    path = profile_store.path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="application/octet-stream", filename=name)
+
+def raise_not_found_or_forbidden(db: Session, rec_id: UUID):
+    """
+    本人のレコメンドが見つからなかった場合に、存在しないのか他人のものなのかを id だけで判定
+    """
+    exists = db.query(RecommendationModel.id).filter(RecommendationModel.id == rec_id).first()
+    if exists is None:
+        raise HTTPException(status_code=404, detail="Recommendation not found")
+    raise HTTPException(status_code=403, detail="Forbidden: You do not have access to this recommendation.")
+
 @app.get("/recommendations/{rec_id}")
 def get_recommendation_detail(request: Request, rec_id: UUID4, db: Session = Depends(get_db)):
     try:
@@ -150,11 +318,23 @@ def get_recommendation_detail(request: Request, rec_id: UUID4, db: Session = Dep
         user_id = me_response_data.get('user',{}).get("userId")
         if not user_id:
             raise HTTPException(status_code=401, detail="Invalid access token")
-        rec = db.query(RecommendationModel).filter(RecommendationModel.id == rec_id).first()
+        uuid_user_id = UUID(user_id)
+        cached = recommendation_cache.get(rec_id)
+        if cached is not None:
+            owner_id, recommendation = cached
+            if owner_id != uuid_user_id:
+                raise HTTPException(status_code=403, detail="Forbidden: You do not have access to this recommendation.")
+            return recommendation
+        # 所有者の確認もSQLで行い、本人の場合だけ内容を読み込む
+        rec = (
+            db.query(RecommendationPayload.payload.label("recommendation")).
+            join(RecommendationModel, RecommendationModel.payload_hash == RecommendationPayload.hash).
+            filter(RecommendationModel.id == rec_id, RecommendationModel.user_id == uuid_user_id).
+            first()
+        )
         if rec is None:
-            raise HTTPException(status_code=404, detail="Recommendation not found")
-        if rec.user_id != UUID(user_id):
-            raise HTTPException(status_code=403, detail="Forbidden: You do not have access to this recommendation.")
+            raise_not_found_or_forbidden(db, rec_id)
+        recommendation_cache.put(rec_id, uuid_user_id, rec.recommendation)
         return rec.recommendation
     except HTTPException as e:
         raise e
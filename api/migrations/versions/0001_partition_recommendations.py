@@ -0,0 +1,131 @@
+"""partition recommendations by month
+
+Revision ID: 0001
+Revises: 
+Create Date: 2025-03-20 00:00:00.000000
+
+"""
+from typing import Sequence, Union
+import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# 現在月から何か月先までパーティションを作っておくか
+MONTHS_AHEAD = 3
+
+
+def _add_months(dt: datetime.datetime, months: int) -> datetime.datetime:
+    index = dt.year * 12 + (dt.month - 1) + months
+    return datetime.datetime(index // 12, index % 12 + 1, 1)
+
+
+def _create_partition(month: datetime.datetime) -> None:
+    name = f"recommendations_y{month.year:04d}m{month.month:02d}"
+    op.execute(
+        f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF recommendations '
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_add_months(month, 1).isoformat()}')"
+    )
+
+
+def _relkind(bind) -> Union[str, None]:
+    return bind.execute(sa.text("SELECT relkind FROM pg_class WHERE oid = to_regclass('recommendations')")).scalar()
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    # パーティションは Postgres のみ。SQLite ではそのまま単一テーブルを使う
+    if bind.dialect.name != "postgresql":
+        return
+    relkind = _relkind(bind)
+    if relkind == "p":
+        return
+
+    has_legacy = relkind == "r"
+    # 内容の列。create_all が新しいモデル（0002 以降）で作ったテーブルなら payload_hash になっている
+    data_column = "recommendation"
+    if has_legacy:
+        columns = {c["name"] for c in sa.inspect(bind).get_columns("recommendations")}
+        if "recommendation" not in columns and "payload_hash" in columns:
+            data_column = "payload_hash"
+        # アプリ起動時の create_all で作られた単一テーブルを退避
+        op.execute("ALTER TABLE recommendations RENAME TO recommendations_legacy")
+        op.execute("ALTER TABLE recommendations_legacy RENAME CONSTRAINT recommendations_pkey TO recommendations_legacy_pkey")
+        op.execute("ALTER INDEX IF EXISTS ix_recommendations_id RENAME TO ix_recommendations_legacy_id")
+        op.execute("ALTER INDEX IF EXISTS ix_recommendations_user_id_created_at RENAME TO ix_recommendations_legacy_user_id_created_at")
+        op.execute("ALTER INDEX IF EXISTS ix_recommendations_payload_hash RENAME TO ix_recommendations_legacy_payload_hash")
+
+    if data_column == "payload_hash":
+        data_definition = " payload_hash varchar(64) NOT NULL,"
+    else:
+        data_definition = " recommendation json NOT NULL,"
+    # パーティションキーは主キーに含める必要がある
+    op.execute(
+        "CREATE TABLE recommendations ("
+        " id uuid NOT NULL,"
+        " user_id uuid NOT NULL,"
+        f"{data_definition}"
+        " created_at timestamp without time zone NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),"
+        " PRIMARY KEY (id, created_at)"
+        ") PARTITION BY RANGE (created_at)"
+    )
+    op.execute("CREATE INDEX ix_recommendations_id ON recommendations (id)")
+    op.execute("CREATE INDEX ix_recommendations_user_id_created_at ON recommendations (user_id, created_at)")
+    if data_column == "payload_hash":
+        # 0002 はこの場合何もしないので、0002 と同じ外部キーとインデックスをここで作る
+        op.execute(
+            "ALTER TABLE recommendations ADD CONSTRAINT fk_recommendations_payload_hash "
+            "FOREIGN KEY (payload_hash) REFERENCES recommendation_payloads (hash)"
+        )
+        op.execute("CREATE INDEX ix_recommendations_payload_hash ON recommendations (payload_hash)")
+
+    now = datetime.datetime.utcnow()
+    first = datetime.datetime(now.year, now.month, 1)
+    if has_legacy:
+        oldest = bind.execute(sa.text("SELECT min(created_at) FROM recommendations_legacy")).scalar()
+        if oldest is not None and oldest < first:
+            first = datetime.datetime(oldest.year, oldest.month, 1)
+    month = first
+    last = _add_months(datetime.datetime(now.year, now.month, 1), MONTHS_AHEAD)
+    while month <= last:
+        _create_partition(month)
+        month = _add_months(month, 1)
+
+    if has_legacy:
+        op.execute(
+            f"INSERT INTO recommendations (id, user_id, {data_column}, created_at) "
+            f"SELECT id, user_id, {data_column}, COALESCE(created_at, now() AT TIME ZONE 'utc') "
+            "FROM recommendations_legacy"
+        )
+        op.execute("DROP TABLE recommendations_legacy")
+
+
+def downgrade() -> None:
+    bind = op.get_bind()
+    if bind.dialect.name != "postgresql" or _relkind(bind) != "p":
+        return
+    op.execute(
+        "CREATE TABLE recommendations_plain ("
+        " id uuid PRIMARY KEY,"
+        " user_id uuid NOT NULL,"
+        " recommendation json NOT NULL,"
+        " created_at timestamp without time zone"
+        ")"
+    )
+    op.execute(
+        "INSERT INTO recommendations_plain (id, user_id, recommendation, created_at) "
+        "SELECT id, user_id, recommendation, created_at FROM recommendations"
+    )
+    # 親テーブルを削除すると全パーティションも削除される
+    op.execute("DROP TABLE recommendations")
+    op.execute("ALTER TABLE recommendations_plain RENAME TO recommendations")
+    op.execute("ALTER TABLE recommendations RENAME CONSTRAINT recommendations_plain_pkey TO recommendations_pkey")
+    op.execute("CREATE INDEX ix_recommendations_id ON recommendations (id)")
+    op.execute("CREATE INDEX ix_recommendations_user_id_created_at ON recommendations (user_id, created_at)")
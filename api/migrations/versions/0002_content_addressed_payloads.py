@@ -0,0 +1,132 @@
+"""store recommendation payloads by content hash
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2025-03-27 00:00:00.000000
+
+"""
+from typing import Sequence, Union
+import datetime
+import hashlib
+import json
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql, sqlite
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BACKFILL_BATCH_SIZE = 1000
+
+payloads_table = sa.table(
+    "recommendation_payloads",
+    sa.column("hash", sa.String),
+    sa.column("payload", sa.JSON),
+    sa.column("created_at", sa.DateTime),
+)
+recommendations_table = sa.table(
+    "recommendations",
+    sa.column("id", sa.Uuid),
+    sa.column("recommendation", sa.JSON),
+    sa.column("payload_hash", sa.String),
+)
+
+
+def _payload_hash(data) -> str:
+    # payloads.py の canonical_json と同じ正規化を使うこと
+    canonical = json.dumps(data, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _insert_payloads(dialect_name: str):
+    if dialect_name == "postgresql":
+        return postgresql.insert(payloads_table).on_conflict_do_nothing(index_elements=["hash"])
+    return sqlite.insert(payloads_table).on_conflict_do_nothing(index_elements=["hash"])
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    if not inspector.has_table("recommendation_payloads"):
+        op.create_table(
+            "recommendation_payloads",
+            sa.Column("hash", sa.String(64), primary_key=True),
+            sa.Column("payload", sa.JSON, nullable=False),
+            sa.Column("created_at", sa.DateTime),
+        )
+    if not inspector.has_table("recommendations"):
+        return
+    columns = {c["name"] for c in inspector.get_columns("recommendations")}
+    if "recommendation" not in columns:
+        # create_all で新しいスキーマのまま作られている
+        return
+    if "payload_hash" not in columns:
+        op.add_column("recommendations", sa.Column("payload_hash", sa.String(64), nullable=True))
+
+    # 既存の行を id 順に少しずつハッシュ化して移す
+    # 毎回先頭から探し直すと、更新済みの行（トランザクション内では回収されない古い行も）を
+    # 読み直すことになるため、ix_recommendations_id を使って前回の続きから読む
+    now = datetime.datetime.utcnow()
+    last_id = None
+    while True:
+        query = (
+            sa.select(recommendations_table.c.id, recommendations_table.c.recommendation)
+            .where(recommendations_table.c.payload_hash.is_(None))
+            .order_by(recommendations_table.c.id)
+            .limit(BACKFILL_BATCH_SIZE)
+        )
+        if last_id is not None:
+            query = query.where(recommendations_table.c.id > last_id)
+        rows = bind.execute(query).all()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        payloads = {}
+        updates = []
+        for rec_id, data in rows:
+            h = _payload_hash(data)
+            payloads[h] = data
+            updates.append({"rec_id": rec_id, "hash": h})
+        bind.execute(
+            _insert_payloads(bind.dialect.name),
+            [{"hash": h, "payload": p, "created_at": now} for h, p in payloads.items()],
+        )
+        bind.execute(
+            recommendations_table.update()
+            .where(recommendations_table.c.id == sa.bindparam("rec_id"))
+            .values(payload_hash=sa.bindparam("hash")),
+            updates,
+        )
+
+    with op.batch_alter_table("recommendations") as batch:
+        batch.alter_column("payload_hash", existing_type=sa.String(64), nullable=False)
+        batch.create_foreign_key(
+            "fk_recommendations_payload_hash",
+            "recommendation_payloads",
+            ["payload_hash"],
+            ["hash"],
+        )
+        batch.create_index("ix_recommendations_payload_hash", ["payload_hash"])
+        batch.drop_column("recommendation")
+
+
+def downgrade() -> None:
+    bind = op.get_bind()
+    columns = {c["name"] for c in sa.inspect(bind).get_columns("recommendations")}
+    if "recommendation" not in columns:
+        op.add_column("recommendations", sa.Column("recommendation", sa.JSON, nullable=True))
+    op.execute(
+        "UPDATE recommendations SET recommendation = "
+        "(SELECT payload FROM recommendation_payloads WHERE recommendation_payloads.hash = recommendations.payload_hash)"
+    )
+    with op.batch_alter_table("recommendations") as batch:
+        batch.alter_column("recommendation", existing_type=sa.JSON, nullable=False)
+        batch.drop_index("ix_recommendations_payload_hash")
+        batch.drop_constraint("fk_recommendations_payload_hash", type_="foreignkey")
+        batch.drop_column("payload_hash")
+    op.drop_table("recommendation_payloads")
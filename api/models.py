@@ -1,9 +1,10 @@
-from sqlalchemy import Column, Integer, String, Boolean
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey
 from sqlalchemy.dialects.postgresql import UUID
 import uuid
 import datetime
-from sqlalchemy import JSON, DateTime
+from sqlalchemy import JSON, DateTime, Index
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import relationship
 
 Base = declarative_base()
 metadata = Base.metadata
@@ -30,9 +31,25 @@ class LanguageFeatures(Base):
     language_id = Column(Integer, nullable=False)
     feature_id = Column(Integer, nullable=False)
     
+class RecommendationPayload(Base):
+    __tablename__ = "recommendation_payloads"
+    # 正規化したJSONのSHA-256。同じ内容のレコメンドは1行だけ保存する（payloads.py を参照）
+    hash = Column(String(64), primary_key=True)
+    payload = Column(JSON, nullable=False)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
 class RecommendationModel(Base):
     __tablename__ = "recommendations"
+    # Postgres では created_at による月次パーティション（migrations/versions/0001 を参照）
+    __table_args__ = (
+        Index("ix_recommendations_user_id_created_at", "user_id", "created_at"),
+    )
     id = Column(UUID(as_uuid=True), primary_key=True, index=True, default=uuid.uuid4)  # UUID型のid
     user_id = Column(UUID(as_uuid=True), nullable=False, default=uuid.uuid4)  # UUID型のuser_id
-    recommendation = Column(JSON, nullable=False)
-    created_at = Column(DateTime, default=datetime.datetime.utcnow)
\ No newline at end of file
+    payload_hash = Column(String(64), ForeignKey("recommendation_payloads.hash"), nullable=False, index=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.datetime.utcnow)
+    payload = relationship(RecommendationPayload, lazy="joined")
+
+    @property
+    def recommendation(self):
+        return self.payload.payload if self.payload is not None else None
\ No newline at end of file
@@ -0,0 +1,275 @@
+"""
+recommendations テーブルの月次パーティション管理とアーカイブ
+
+使い方:
+    python partitions.py ensure                      # 先の月のパーティションを作成（APIサーバーも定期的に実行する）
+    python partitions.py archive --older-than-months 12
+    python partitions.py restore --month 2024-01
+
+復元した月が保持期間（RECOMMENDATION_RETENTION_MONTHS）より古い場合、/history には出ない
+（/history は hot_cutoff() 以降だけを検索する）。復元は /history/export と詳細の閲覧のために行う。
+
+アーカイブしてもその月の recommendation_payloads の行は削除しない。同じ内容を保持期間内の
+行が参照していることがあり、参照がなくなったかを安全に判定するには保存処理との排他が必要なため。
+recommendation_payloads は内容の種類数の分だけ増え続ける。
+"""
+import argparse
+import asyncio
+import datetime
+import gzip
+import json
+import os
+import uuid
+from os import getenv
+from typing import Iterable, Iterator, List, Optional, Tuple
+from sqlalchemy import text, insert
+from models import RecommendationModel
+from export import serialize_row
+from payloads import insert_payloads, payload_hash
+
+# 何か月先までパーティションを作っておくか
+PARTITION_MONTHS_AHEAD = int(getenv("PARTITION_MONTHS_AHEAD", "3"))
+# APIサーバーが先の月のパーティションを作成し直す間隔（秒）
+PARTITION_ENSURE_INTERVAL = float(getenv("PARTITION_ENSURE_INTERVAL", "86400"))
+# 設定した月数より古いパーティションはアーカイブ対象（未設定なら無期限に保持）
+RECOMMENDATION_RETENTION_MONTHS = getenv("RECOMMENDATION_RETENTION_MONTHS")
+RECOMMENDATION_ARCHIVE_DIR = getenv("RECOMMENDATION_ARCHIVE_DIR", "./archive")
+
+PARENT_TABLE = RecommendationModel.__tablename__
+RESTORE_BATCH_SIZE = 1000
+
+
+def month_start(dt: datetime.datetime) -> datetime.datetime:
+    return datetime.datetime(dt.year, dt.month, 1)
+
+
+def add_months(dt: datetime.datetime, months: int) -> datetime.datetime:
+    index = dt.year * 12 + (dt.month - 1) + months
+    return datetime.datetime(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: datetime.datetime) -> str:
+    return f"{PARENT_TABLE}_y{month.year:04d}m{month.month:02d}"
+
+
+def parse_partition_name(name: str) -> Optional[datetime.datetime]:
+    """
+    パーティション名から対象月を取り出す（命名規則に合わなければ None）
+    """
+    prefix = f"{PARENT_TABLE}_y"
+    if not name.startswith(prefix):
+        return None
+    try:
+        year, month = name[len(prefix):].split("m")
+        return datetime.datetime(int(year), int(month), 1)
+    except ValueError:
+        return None
+
+
+def hot_cutoff(now: Optional[datetime.datetime] = None) -> Optional[datetime.datetime]:
+    """
+    保持期間の開始時刻。/history などの検索条件に入れてパーティションプルーニングを効かせる
+    """
+    if not RECOMMENDATION_RETENTION_MONTHS:
+        return None
+    now = now or datetime.datetime.utcnow()
+    return add_months(month_start(now), -int(RECOMMENDATION_RETENTION_MONTHS))
+
+
+def is_partitioned(conn) -> bool:
+    """
+    Postgres かつ recommendations が宣言的パーティションテーブルの場合のみ True
+    SQLite（テスト）やマイグレーション前のDBでは何もしない
+    """
+    if conn.dialect.name != "postgresql":
+        return False
+    relkind = conn.execute(
+        text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:name)"),
+        {"name": PARENT_TABLE},
+    ).scalar()
+    return relkind == "p"
+
+
+def create_partition(conn, month: datetime.datetime) -> str:
+    name = partition_name(month)
+    conn.execute(text(
+        f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{PARENT_TABLE}" '
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    ))
+    return name
+
+
+def list_partitions(conn) -> List[Tuple[str, datetime.datetime]]:
+    rows = conn.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(:name)"
+        ),
+        {"name": PARENT_TABLE},
+    ).scalars()
+    partitions = []
+    for name in rows:
+        month = parse_partition_name(name)
+        if month is not None:
+            partitions.append((name, month))
+    return sorted(partitions, key=lambda p: p[1])
+
+
+def ensure_future_partitions(engine, months_ahead: int = PARTITION_MONTHS_AHEAD) -> List[str]:
+    """
+    今月から months_ahead か月先までのパーティションを作成（作成済みならスキップ）
+    """
+    with engine.begin() as conn:
+        if not is_partitioned(conn):
+            return []
+        current = month_start(datetime.datetime.utcnow())
+        return [create_partition(conn, add_months(current, i)) for i in range(months_ahead + 1)]
+
+
+async def ensure_partitions_periodically(engine, interval: float = PARTITION_ENSURE_INTERVAL) -> None:
+    """
+    interval 秒ごとに ensure_future_partitions を実行し続ける（キャンセルされるまで）
+    再起動しないまま月が変わっても、行を入れる先のパーティションがなくならないようにする
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            # DBアクセスはイベントループを止めないよう別スレッドで行う
+            await asyncio.to_thread(ensure_future_partitions, engine)
+        except Exception as e:
+            # 失敗しても次の回で作り直す（複数ワーカーが同時に作成した場合など）
+            print(f"ensure_future_partitions failed: {e}")
+
+
+def archive_path(archive_dir: str, month: datetime.datetime) -> str:
+    return os.path.join(archive_dir, f"{partition_name(month)}.ndjson.gz")
+
+
+def write_archive(path: str, rows: Iterable) -> int:
+    """
+    行をgzip圧縮したNDJSONとして書き出す。書き込み途中のファイルを残さないよう一時ファイルから置き換える
+    """
+    tmp_path = path + ".tmp"
+    count = 0
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(serialize_row(row), ensure_ascii=False) + "\n")
+            count += 1
+    os.replace(tmp_path, path)
+    return count
+
+
+def read_archive(path: str) -> Iterator[dict]:
+    """
+    アーカイブファイルをDBに挿入できる形で1行ずつ読み出す
+    """
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            row = json.loads(line)
+            yield {
+                "id": uuid.UUID(row["id"]),
+                "user_id": uuid.UUID(row["user_id"]),
+                "created_at": datetime.datetime.fromisoformat(row["created_at"]),
+                "recommendation": row["recommendation"],
+            }
+
+
+def archive_partitions(engine, older_than_months: int, archive_dir: str = RECOMMENDATION_ARCHIVE_DIR) -> List[str]:
+    """
+    older_than_months か月より古いパーティションを切り離してファイルに退避し、テーブルを削除する
+    1パーティションごとに1トランザクションで処理し、書き出しに失敗した場合はロールバックされる
+    参照先の recommendation_payloads の行は残す（ファイルには内容も書き出す）
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    cutoff = add_months(month_start(datetime.datetime.utcnow()), -older_than_months)
+    with engine.connect() as conn:
+        if not is_partitioned(conn):
+            return []
+        targets = [(name, month) for name, month in list_partitions(conn) if month < cutoff]
+
+    archived = []
+    for name, month in targets:
+        path = archive_path(archive_dir, month)
+        with engine.begin() as conn:
+            conn.execute(text(f'ALTER TABLE "{PARENT_TABLE}" DETACH PARTITION "{name}"'))
+            rows = conn.execution_options(stream_results=True, yield_per=RESTORE_BATCH_SIZE).execute(
+                text(
+                    f'SELECT r.id, r.user_id, p.payload AS recommendation, r.created_at FROM "{name}" r '
+                    "JOIN recommendation_payloads p ON p.hash = r.payload_hash "
+                    "ORDER BY r.created_at, r.id"
+                )
+            )
+            count = write_archive(path, rows)
+            conn.execute(text(f'DROP TABLE "{name}"'))
+        print(f"archived {name}: {count} rows -> {path}")
+        archived.append(path)
+    return archived
+
+
+def _restore_rows(conn, rows: List[dict]) -> int:
+    """
+    レコメンド内容を recommendation_payloads に戻してから、ハッシュで参照する行を挿入する
+    """
+    payloads = {}
+    records = []
+    for row in rows:
+        h = payload_hash(row["recommendation"])
+        payloads[h] = row["recommendation"]
+        records.append({
+            "id": row["id"],
+            "user_id": row["user_id"],
+            "created_at": row["created_at"],
+            "payload_hash": h,
+        })
+    conn.execute(insert_payloads(conn.dialect.name), [{"hash": h, "payload": p} for h, p in payloads.items()])
+    conn.execute(insert(RecommendationModel.__table__), records)
+    return len(records)
+
+
+def restore_partition(engine, month: datetime.datetime, archive_dir: str = RECOMMENDATION_ARCHIVE_DIR) -> int:
+    """
+    アーカイブファイルからパーティションを作り直して行を戻す
+    保持期間より古い月は /history の検索対象外のまま（エクスポートと詳細の閲覧で使える）
+    """
+    month = month_start(month)
+    path = archive_path(archive_dir, month)
+    count = 0
+    with engine.begin() as conn:
+        create_partition(conn, month)
+        batch = []
+        for row in read_archive(path):
+            batch.append(row)
+            if len(batch) >= RESTORE_BATCH_SIZE:
+                count += _restore_rows(conn, batch)
+                batch = []
+        if batch:
+            count += _restore_rows(conn, batch)
+    print(f"restored {partition_name(month)}: {count} rows <- {path}")
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="recommendations パーティション管理")
+    sub = parser.add_subparsers(dest="command", required=True)
+    ensure = sub.add_parser("ensure")
+    ensure.add_argument("--months-ahead", type=int, default=PARTITION_MONTHS_AHEAD)
+    archive = sub.add_parser("archive")
+    archive.add_argument("--older-than-months", type=int, default=int(RECOMMENDATION_RETENTION_MONTHS or 12))
+    archive.add_argument("--dir", default=RECOMMENDATION_ARCHIVE_DIR)
+    restore = sub.add_parser("restore")
+    restore.add_argument("--month", required=True, help="YYYY-MM")
+    restore.add_argument("--dir", default=RECOMMENDATION_ARCHIVE_DIR)
+    args = parser.parse_args(argv)
+
+    from database import engine
+    if args.command == "ensure":
+        print(ensure_future_partitions(engine, args.months_ahead))
+    elif args.command == "archive":
+        archive_partitions(engine, args.older_than_months, args.dir)
+    elif args.command == "restore":
+        restore_partition(engine, datetime.datetime.strptime(args.month, "%Y-%m"), args.dir)
+
+
+if __name__ == "__main__":
+    main()
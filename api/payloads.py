@@ -0,0 +1,41 @@
+"""
+レコメンド内容（JSON）のコンテンツアドレス保存
+
+同じ内容のJSONは正規化した文字列のハッシュで1行にまとめ、
+recommendations からはハッシュで参照する。
+"""
+import hashlib
+import json
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from models import RecommendationPayload
+
+
+def canonical_json(data) -> str:
+    """
+    キー順・空白を揃えたJSON文字列（同じ内容なら同じ文字列になる）
+    """
+    return json.dumps(data, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+
+def payload_hash(data) -> str:
+    return hashlib.sha256(canonical_json(data).encode("utf-8")).hexdigest()
+
+
+def insert_payloads(dialect_name: str):
+    """
+    既に同じハッシュがあれば何もしない INSERT 文
+    """
+    table = RecommendationPayload.__table__
+    if dialect_name == "postgresql":
+        return postgresql.insert(table).on_conflict_do_nothing(index_elements=["hash"])
+    return sqlite.insert(table).on_conflict_do_nothing(index_elements=["hash"])
+
+
+def store_payload(db: Session, data) -> str:
+    """
+    レコメンド内容を保存してハッシュを返す（保存済みなら再利用）
+    """
+    h = payload_hash(data)
+    db.execute(insert_payloads(db.get_bind().dialect.name), [{"hash": h, "payload": data}])
+    return h
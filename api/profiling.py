@@ -0,0 +1,128 @@
+"""
+リクエスト単位のプロファイリング
+
+デバッグ用ヘッダー（X-Debug-Profile: <PROFILING_TOKEN>）付きのリクエスト、
+またはサンプリング率で選ばれたリクエストだけを cProfile で計測し、
+結果を件数上限付きのディレクトリ（リングバッファ）に保存する。
+
+Python 3.12 の cProfile は全スレッドを計測するため、スレッドプールで動く
+同期ハンドラーやDBアクセスも含まれる。同時に有効にできるプロファイラーは1つだけなので、
+計測中に来た別のリクエストは計測せずにそのまま処理する（その間の処理は結果に混ざりうる）。
+"""
+import cProfile
+import datetime
+import hmac
+import os
+import random
+import re
+import threading
+import time
+from os import getenv
+from typing import List, Optional
+
+PROFILING_TOKEN = getenv("PROFILING_TOKEN", "")
+PROFILING_SAMPLE_RATE = float(getenv("PROFILING_SAMPLE_RATE", "0"))
+PROFILING_DIR = getenv("PROFILING_DIR", "./profiles")
+PROFILING_MAX_FILES = int(getenv("PROFILING_MAX_FILES", "50"))
+PROFILING_HEADER = b"x-debug-profile"
+
+_profile_lock = threading.Lock()
+
+
+def profiling_enabled(token: str = PROFILING_TOKEN, sample_rate: float = PROFILING_SAMPLE_RATE) -> bool:
+    """
+    トークンもサンプリング率も未設定ならミドルウェア自体を登録しない（オーバーヘッドなし）
+    """
+    return bool(token) or sample_rate > 0
+
+
+class ProfileStore:
+    """
+    プロファイル結果（.prof）を新しい順に max_files 件まで保持する
+    """
+
+    def __init__(self, directory: str = PROFILING_DIR, max_files: int = PROFILING_MAX_FILES):
+        self.directory = directory
+        self.max_files = max_files
+        self._lock = threading.Lock()
+
+    def _files(self) -> List[str]:
+        if not os.path.isdir(self.directory):
+            return []
+        # ファイル名の先頭がタイムスタンプなので名前順 = 作成順
+        return sorted(f for f in os.listdir(self.directory) if f.endswith(".prof"))
+
+    def save(self, profiler: cProfile.Profile, method: str, path: str, elapsed_ms: float) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        slug = re.sub(r"[^A-Za-z0-9]+", "_", path).strip("_") or "root"
+        stamp = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
+        name = f"{stamp}-{method}-{slug}-{elapsed_ms:.0f}ms.prof"
+        with self._lock:
+            profiler.dump_stats(os.path.join(self.directory, name))
+            files = self._files()
+            for old in files[:max(len(files) - self.max_files, 0)]:
+                os.remove(os.path.join(self.directory, old))
+        return name
+
+    def list(self) -> List[dict]:
+        profiles = []
+        for name in reversed(self._files()):
+            stat = os.stat(os.path.join(self.directory, name))
+            profiles.append({
+                "name": name,
+                "size": stat.st_size,
+                "created_at": datetime.datetime.utcfromtimestamp(stat.st_mtime).isoformat(),
+            })
+        return profiles
+
+    def path(self, name: str) -> Optional[str]:
+        """
+        保存済みのファイル名だけを受け付ける（ディレクトリ外のパスは None）
+        """
+        if name not in self._files():
+            return None
+        return os.path.join(self.directory, name)
+
+
+class ProfilingMiddleware:
+    """
+    ASGIミドルウェア。選ばれたリクエストのハンドラー全体を cProfile で囲む
+    """
+
+    def __init__(self, app, store: ProfileStore, token: str = PROFILING_TOKEN, sample_rate: float = PROFILING_SAMPLE_RATE):
+        self.app = app
+        self.store = store
+        self.token = token.encode("utf-8")
+        self.sample_rate = sample_rate
+
+    def _should_profile(self, scope) -> bool:
+        if self.token:
+            for key, value in scope["headers"]:
+                if key == PROFILING_HEADER:
+                    return hmac.compare_digest(value, self.token)
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._should_profile(scope):
+            await self.app(scope, receive, send)
+            return
+        if not _profile_lock.acquire(blocking=False):
+            # 他のリクエストを計測中
+            await self.app(scope, receive, send)
+            return
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # プロセス内で別のプロファイラーが動いている
+            _profile_lock.release()
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            profiler.disable()
+            _profile_lock.release()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.store.save(profiler, scope["method"], scope["path"], elapsed_ms)
@@ -0,0 +1,187 @@
+"""
+1回の生成で複数のアイデアを出させ、余ったアイデアをプロフィールごとに取っておく
+
+同じ回答内容（プロフィール）のリクエストは、LLMを呼ぶ前にここからアイデアを取り出す。
+同じユーザーに同じアイデアを2回出さないよう、ユーザーごとに出したアイデアのハッシュを覚えておく。
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+from os import getenv
+from typing import List, Optional
+from payloads import payload_hash
+
+# 余ったアイデアを保持する秒数
+IDEA_RESERVOIR_TTL = float(getenv("IDEA_RESERVOIR_TTL", "86400"))
+# 1プロフィールあたりに保持するアイデアの上限
+IDEA_RESERVOIR_MAX_PER_PROFILE = int(getenv("IDEA_RESERVOIR_MAX_PER_PROFILE", "20"))
+# 保持するプロフィールの数（超えたら最近使われていないものから消える）
+IDEA_RESERVOIR_MAX_PROFILES = int(getenv("IDEA_RESERVOIR_MAX_PROFILES", "1000"))
+# 出したアイデアを覚えておくユーザー数と、1ユーザーあたりの件数
+IDEA_SERVED_MAX_USERS = int(getenv("IDEA_SERVED_MAX_USERS", "10000"))
+IDEA_SERVED_MAX_PER_USER = int(getenv("IDEA_SERVED_MAX_PER_USER", "200"))
+
+IDEA_STRING_FIELDS = ("title", "description")
+IDEA_LIST_FIELDS = ("roadmap", "technologies", "outcomes")
+# プロンプトの出力フォーマットの例に書いてある値。そのまま返ってきたものはアイデアとして扱わない
+IDEA_PLACEHOLDER = "string"
+
+
+def ideas_per_call() -> int:
+    """
+    1回の生成で出させるアイデアの数（1なら従来通り単一のアイデア）
+    """
+    return max(int(getenv("DEEPSEEK_IDEAS_PER_CALL", "1")), 1)
+
+
+def _is_filled(value) -> bool:
+    return isinstance(value, str) and bool(value.strip()) and value.strip().casefold() != IDEA_PLACEHOLDER
+
+
+def validate_idea(idea) -> bool:
+    """
+    title/description/roadmap/technologies/outcomes の形式を満たすか
+    空文字やプロンプトの例の "string" のままの項目があるものは不可
+    """
+    if not isinstance(idea, dict):
+        return False
+    for field in IDEA_STRING_FIELDS:
+        if not _is_filled(idea.get(field)):
+            return False
+    for field in IDEA_LIST_FIELDS:
+        value = idea.get(field)
+        if not isinstance(value, list) or not value or not all(_is_filled(v) for v in value):
+            return False
+    return True
+
+
+def profile_key(engineer_type: str, programming_language: str, learning_preference: str, interest_fields: List[str]) -> str:
+    """
+    大文字小文字・前後の空白・興味のある分野の順序の違いを無視したキー
+    """
+    def normalize(value: str) -> str:
+        return value.strip().casefold()
+
+    return json.dumps([
+        normalize(engineer_type),
+        normalize(programming_language),
+        normalize(learning_preference),
+        sorted({normalize(f) for f in interest_fields if f.strip()}),
+    ], ensure_ascii=False)
+
+
+class IdeaReservoir:
+    def __init__(
+        self,
+        ttl: float = IDEA_RESERVOIR_TTL,
+        max_per_profile: int = IDEA_RESERVOIR_MAX_PER_PROFILE,
+        max_profiles: int = IDEA_RESERVOIR_MAX_PROFILES,
+        max_users: int = IDEA_SERVED_MAX_USERS,
+        max_served_per_user: int = IDEA_SERVED_MAX_PER_USER,
+    ):
+        self.ttl = ttl
+        self.max_per_profile = max_per_profile
+        self.max_profiles = max_profiles
+        self.max_users = max_users
+        self.max_served_per_user = max_served_per_user
+        self._lock = threading.Lock()
+        # profile_key -> [(期限, ハッシュ, アイデア)]（最近使われていないものから消える）
+        self._ideas = OrderedDict()
+        # user_id -> 出したアイデアのハッシュ（古いものから消える）
+        self._served = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0, "stored": 0, "expired": 0}
+
+    def _has_served(self, user_id: Optional[str], h: str) -> bool:
+        return user_id is not None and h in self._served.get(user_id, ())
+
+    def _mark_served(self, user_id: Optional[str], h: str) -> None:
+        if user_id is None:
+            return
+        served = self._served.pop(user_id, None) or OrderedDict()
+        served[h] = None
+        while len(served) > self.max_served_per_user:
+            served.popitem(last=False)
+        self._served[user_id] = served
+        while len(self._served) > self.max_users:
+            self._served.popitem(last=False)
+
+    def take(self, key: str, user_id: Optional[str] = None) -> Optional[dict]:
+        """
+        そのユーザーにまだ出していないアイデアを1つ取り出す（なければ None）
+        """
+        now = time.monotonic()
+        with self._lock:
+            entries = self._ideas.get(key, [])
+            alive = [e for e in entries if e[0] > now]
+            self._stats["expired"] += len(entries) - len(alive)
+            for i, (_, h, idea) in enumerate(alive):
+                if not self._has_served(user_id, h):
+                    del alive[i]
+                    self._store(key, alive)
+                    self._mark_served(user_id, h)
+                    self._stats["hits"] += 1
+                    return idea
+            self._store(key, alive)
+            self._stats["misses"] += 1
+            return None
+
+    def _store(self, key: str, entries) -> None:
+        self._ideas.pop(key, None)
+        if entries:
+            self._ideas[key] = entries
+        while len(self._ideas) > self.max_profiles:
+            self._ideas.popitem(last=False)
+
+    def _sweep(self, now: float) -> None:
+        """
+        期限切れのアイデアを全プロフィールから消し、空になったプロフィールを消す
+        """
+        for key in list(self._ideas):
+            entries = self._ideas[key]
+            alive = [e for e in entries if e[0] > now]
+            self._stats["expired"] += len(entries) - len(alive)
+            if not alive:
+                del self._ideas[key]
+            elif len(alive) != len(entries):
+                self._ideas[key] = alive
+
+    def pick(self, key: str, ideas: List[dict], user_id: Optional[str] = None) -> Optional[dict]:
+        """
+        生成したアイデアから1つをユーザーに返し、残りを保持する
+        """
+        now = time.monotonic()
+        with self._lock:
+            # 二度と参照されないプロフィールが残り続けないよう、生成のたびに掃除する
+            self._sweep(now)
+            chosen = None
+            rest = []
+            for idea in ideas:
+                h = payload_hash(idea)
+                if chosen is None and not self._has_served(user_id, h):
+                    chosen = idea
+                    self._mark_served(user_id, h)
+                else:
+                    rest.append((h, idea))
+            if chosen is None and ideas:
+                # すべて出したことのあるアイデアだった場合は先頭を返す
+                chosen = ideas[0]
+                rest = rest[1:]
+            expires_at = now + self.ttl
+            entries = self._ideas.get(key, [])
+            known = {e[1] for e in entries}
+            for h, idea in rest:
+                if h not in known:
+                    entries.append((expires_at, h, idea))
+                    known.add(h)
+                    self._stats["stored"] += 1
+            self._store(key, entries[-self.max_per_profile:])
+            return chosen
+
+    def mark_served(self, user_id: Optional[str], idea: dict) -> None:
+        with self._lock:
+            self._mark_served(user_id, payload_hash(idea))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "profiles": len(self._ideas), "ideas": sum(len(v) for v in self._ideas.values())}
@@ -0,0 +1,193 @@
+from fastapi.testclient import TestClient
+from main import app
+import deepseek
+from deepseek import DeepSeekError, find_complete_json, extract_json_text, generate
+from main import build_prompt, submit_data
+import pytest
+import json
+
+client = TestClient(app)
+
+IDEA = {"title": "Test Title", "description": "desc", "roadmap": ["a"], "technologies": ["b"], "outcomes": ["c"]}
+
+# ストリーミングレスポンスの代替オブジェクト
+class FakeStreamResponse:
+    def __init__(self, chunks, status_code=200, content_type="text/plain"):
+        self.chunks = chunks
+        self.status_code = status_code
+        self.headers = {"Content-Type": content_type}
+        self.encoding = "utf-8"
+        self.text = ""
+        self.consumed = 0
+        self.closed = False
+
+    def iter_content(self, chunk_size=None, decode_unicode=False):
+        for chunk in self.chunks:
+            self.consumed += 1
+            yield chunk
+
+    def json(self):
+        return {"response": "".join(self.chunks)}
+
+    def close(self):
+        self.closed = True
+
+def idea_chunks(trailing=10):
+    """思考 → ```json フェンス → JSON → フェンス後の余計な出力、の順に生成されるチャンク"""
+    body = json.dumps(IDEA, ensure_ascii=False)
+    chunks = ["<think>", "```json {\"draft\": 1} ```", "考え中", "</think>", "```json\n"]
+    chunks += [body[i:i + 5] for i in range(0, len(body), 5)]
+    chunks += ["\n```"]
+    chunks += ["余計な説明"] * trailing
+    return chunks
+
+def test_find_complete_json_ignores_thinking_and_partial():
+    assert find_complete_json('<think>```json {"a": 1} ```') is None
+    assert find_complete_json('</think>```json {"a": 1') is None
+    assert find_complete_json('</think>```json {"a": 1}\n```') == '{"a": 1}'
+    # フェンスがなくても括弧が閉じれば完結とみなす（文字列中の括弧は無視）
+    assert find_complete_json('</think> {"a": "}{", "b": [1]} 以上') == '{"a": "}{", "b": [1]}'
+
+def test_extract_json_text_prompt_echo():
+    # プロンプトの「```jsonと```」が含まれていても回答部分を取り出す
+    raw = "必ず、```jsonと```で囲んで</think>```json\n" + json.dumps(IDEA) + "\n```"
+    assert json.loads(extract_json_text(raw)) == IDEA
+
+def test_extract_json_text_truncated_does_not_return_prompt_example():
+    """
+    思考の途中で上限に達した場合、プロンプトの出力例や思考中の下書きを回答にしない
+    """
+    data = submit_data(engineerType="バックエンド", programmingLanguage="Python", learningPreference="初心者向け", interestFields=["音楽"])
+    prompt = build_prompt(data)
+    for stop_reason in ("max_tokens", "timeout", "eos"):
+        with pytest.raises(DeepSeekError):
+            extract_json_text(prompt + "<think>まず考えます", prompt, stop_reason)
+    with pytest.raises(DeepSeekError):
+        extract_json_text(prompt + '<think>下書き ```json {"title": "x"} ```', prompt, "max_tokens")
+
+def test_extract_json_text_without_think_tags_on_eos():
+    # </think> を出さないサーバーでも、最後まで生成された場合は回答を取り出す
+    raw = "prompt" + json.dumps(IDEA)
+    assert json.loads(extract_json_text(raw, "prompt", "eos")) == IDEA
+
+def test_submit_deepseek_truncated_generation(monkeypatch):
+    fake = FakeStreamResponse(["<think>", "考え中"] * 50)
+    monkeypatch.setattr("requests.post", lambda *args, **kwargs: fake)
+    monkeypatch.setattr(deepseek, "DEEPSEEK_MAX_TOKENS", 10)
+    payload = {
+        "engineerType": "バックエンド",
+        "programmingLanguage": "Python",
+        "learningPreference": "初心者向け",
+        "interestFields": ["音楽"],
+    }
+    response = client.post("/submit_deepseek", json=payload)
+    assert response.json() == {
+        "error": "DeepSeek generation stopped before the answer was complete.",
+        "details": "stop_reason: max_tokens",
+    }
+
+def test_generate_stops_when_json_complete(monkeypatch):
+    fake = FakeStreamResponse(idea_chunks())
+    monkeypatch.setattr("requests.post", lambda *args, **kwargs: fake)
+    before = deepseek.get_metrics()
+
+    raw, stop_reason = generate("prompt", max_tokens=1000)
+
+    assert stop_reason == "json_complete"
+    assert json.loads(extract_json_text(raw, "prompt", stop_reason)) == IDEA
+    # フェンスが閉じた後のチャンクは読まずに接続を閉じる
+    assert fake.consumed == len(idea_chunks()) - 10
+    assert fake.closed
+    after = deepseek.get_metrics()
+    assert after["stop_reasons"]["json_complete"] == before["stop_reasons"].get("json_complete", 0) + 1
+    assert after["tokens_below_budget"] - before["tokens_below_budget"] == 1000 - fake.consumed
+
+def test_generate_max_tokens_budget(monkeypatch):
+    fake = FakeStreamResponse(["考え中"] * 100)
+    monkeypatch.setattr("requests.post", lambda *args, **kwargs: fake)
+
+    _, stop_reason = generate("prompt", max_tokens=5)
+
+    assert stop_reason == "max_tokens"
+    assert fake.consumed == 5
+    assert fake.closed
+
+def test_generate_non_streaming_server(monkeypatch):
+    fake = FakeStreamResponse(idea_chunks(), content_type="application/json")
+    monkeypatch.setattr("requests.post", lambda *args, **kwargs: fake)
+
+    raw, stop_reason = generate("prompt")
+
+    assert stop_reason == "not_streamed"
+    assert raw == "".join(idea_chunks())
+    assert fake.closed
+
+def test_submit_deepseek_anonymous(monkeypatch):
+    monkeypatch.setattr("requests.post", lambda *args, **kwargs: FakeStreamResponse(idea_chunks()))
+    payload = {
+        "engineerType": "バックエンド",
+        "programmingLanguage": "Python",
+        "learningPreference": "初心者向け",
+        "interestFields": ["音楽"],
+    }
+    response = client.post("/submit_deepseek", json=payload)
+    assert response.status_code == 200, response.text
+    assert response.json() == IDEA
+
+def test_submit_deepseek_upstream_error(monkeypatch):
+    fake = FakeStreamResponse([], status_code=503)
+    fake.text = "busy"
+    monkeypatch.setattr("requests.post", lambda *args, **kwargs: fake)
+    before = deepseek.get_metrics()
+    payload = {
+        "engineerType": "バックエンド",
+        "programmingLanguage": "Python",
+        "learningPreference": "初心者向け",
+        "interestFields": ["音楽"],
+    }
+    response = client.post("/submit_deepseek", json=payload)
+    assert response.json() == {"error": "Failed to fetch from DeepSeek API. Status Code: 503", "details": "busy"}
+    after = deepseek.get_metrics()
+    assert after["stop_reasons"]["http_error"] == before["stop_reasons"].get("http_error", 0) + 1
+
+def test_generate_read_timeout_while_queued(monkeypatch):
+    """
+    GPUの順番待ちなどで読み込みがタイムアウトした場合は DeepSeekError になり、timeout として記録される
+    """
+    import requests
+    def mock_post(*args, **kwargs):
+        raise requests.exceptions.ReadTimeout("Read timed out.")
+    monkeypatch.setattr("requests.post", mock_post)
+    before = deepseek.get_metrics()
+
+    with pytest.raises(DeepSeekError):
+        generate("prompt")
+
+    after = deepseek.get_metrics()
+    assert after["stop_reasons"]["timeout"] == before["stop_reasons"].get("timeout", 0) + 1
+
+def test_submit_deepseek_stream_stalled(monkeypatch):
+    import requests
+    from urllib3.exceptions import ReadTimeoutError
+
+    class StalledResponse(FakeStreamResponse):
+        def iter_content(self, chunk_size=None, decode_unicode=False):
+            yield "<think>"
+            # requests はストリーム読み込み中のタイムアウトを ConnectionError で包んで送出する
+            raise requests.exceptions.ConnectionError(ReadTimeoutError(None, None, "Read timed out."))
+
+    fake = StalledResponse([])
+    monkeypatch.setattr("requests.post", lambda *args, **kwargs: fake)
+    before = deepseek.get_metrics()
+    payload = {
+        "engineerType": "バックエンド",
+        "programmingLanguage": "Python",
+        "learningPreference": "初心者向け",
+        "interestFields": ["音楽"],
+    }
+    response = client.post("/submit_deepseek", json=payload)
+    assert response.status_code == 200
+    assert response.json()["error"] == "Failed to fetch from DeepSeek API."
+    assert fake.closed
+    after = deepseek.get_metrics()
+    assert after["stop_reasons"]["timeout"] == before["stop_reasons"].get("timeout", 0) + 1
@@ -0,0 +1,133 @@
+from fastapi.testclient import TestClient
+from main import app, get_db
+from models import Base, RecommendationModel
+from payloads import store_payload
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from uuid import uuid4, UUID
+import datetime
+import gzip
+import json
+import csv
+import io
+
+client = TestClient(app)
+
+# テスト用のインメモリSQLite
+engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+Base.metadata.create_all(engine)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def override_get_db():
+    db = TestingSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+def seed(user_id, count, other_user_id=None):
+    """指定ユーザーのレコメンドを count 件作成（created_at は1分ずつずらす）"""
+    db = TestingSessionLocal()
+    db.query(RecommendationModel).delete()
+    base = datetime.datetime(2025, 1, 1)
+    for i in range(count):
+        db.add(RecommendationModel(
+            user_id=UUID(user_id),
+            payload_hash=store_payload(db, {"title": f"Title {i}", "description": "desc"}),
+            created_at=base + datetime.timedelta(minutes=i),
+        ))
+    if other_user_id:
+        db.add(RecommendationModel(
+            user_id=UUID(other_user_id),
+            payload_hash=store_payload(db, {"title": "Other", "description": "desc"}),
+            created_at=base,
+        ))
+    db.commit()
+    db.close()
+
+headers = {"Authorization": "Bearer valid_token"}
+
+def test_export_ndjson_only_own_rows(mock_auth):
+    user_id = str(uuid4())
+    seed(user_id, 5, other_user_id=str(uuid4()))
+    mock_auth(user_id)
+    app.dependency_overrides[get_db] = override_get_db
+
+    response = client.get("/history/export", headers=headers)
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(l) for l in response.text.splitlines()]
+    assert len(lines) == 5
+    assert all(l["user_id"] == user_id for l in lines)
+    # 古い順に並ぶ
+    assert [l["recommendation"]["title"] for l in lines] == [f"Title {i}" for i in range(5)]
+
+def test_export_resume_from_checkpoint(mock_auth):
+    user_id = str(uuid4())
+    seed(user_id, 5)
+    mock_auth(user_id)
+    app.dependency_overrides[get_db] = override_get_db
+
+    first = [json.loads(l) for l in client.get("/history/export", headers=headers).text.splitlines()]
+    checkpoint = first[1]
+    response = client.get(
+        "/history/export",
+        headers=headers,
+        params={"after_created_at": checkpoint["created_at"], "after_id": checkpoint["id"]},
+    )
+    assert response.status_code == 200, response.text
+    resumed = [json.loads(l) for l in response.text.splitlines()]
+    assert [l["id"] for l in resumed] == [l["id"] for l in first[2:]]
+
+def test_export_csv_gzip(mock_auth):
+    user_id = str(uuid4())
+    seed(user_id, 3)
+    mock_auth(user_id)
+    app.dependency_overrides[get_db] = override_get_db
+
+    response = client.get("/history/export", headers=headers, params={"format": "csv", "compress": "true"})
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"] == "application/gzip"
+    text = gzip.decompress(response.content).decode("utf-8")
+    rows = list(csv.DictReader(io.StringIO(text)))
+    assert len(rows) == 3
+    assert json.loads(rows[0]["recommendation"])["title"] == "Title 0"
+
+def test_export_all_users_requires_admin(monkeypatch, mock_auth):
+    user_id = str(uuid4())
+    mock_auth(user_id)
+    monkeypatch.setenv("ADMIN_USER_IDS", "")
+    app.dependency_overrides[get_db] = override_get_db
+
+    response = client.get("/history/export", headers=headers, params={"all_users": "true"})
+    assert response.status_code == 403
+    assert response.json()["detail"] == "Forbidden: Admin only."
+
+def test_export_all_users_date_range_for_admin(monkeypatch, mock_auth):
+    user_id = str(uuid4())
+    seed(user_id, 5, other_user_id=str(uuid4()))
+    mock_auth(user_id)
+    monkeypatch.setenv("ADMIN_USER_IDS", user_id)
+    app.dependency_overrides[get_db] = override_get_db
+
+    response = client.get(
+        "/history/export",
+        headers=headers,
+        params={"all_users": "true", "start": "2025-01-01T00:00:00", "end": "2025-01-01T00:02:00"},
+    )
+    assert response.status_code == 200, response.text
+    lines = [json.loads(l) for l in response.text.splitlines()]
+    # 00:00 の2件（本人と他ユーザー）と 00:01 の1件
+    assert len(lines) == 3
+    assert len({l["user_id"] for l in lines}) == 2
+
+def test_export_no_token():
+    app.dependency_overrides[get_db] = override_get_db
+    response = client.get("/history/export")
+    assert response.status_code == 401
+    assert response.json()["detail"] == "Authorization header is missing."
+
+# テスト終了後、依存関係のオーバーライドをクリア
+def teardown_module(module):
+    app.dependency_overrides = {}
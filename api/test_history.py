@@ -1,14 +1,19 @@
 from fastapi.testclient import TestClient
 from main import app, get_db
 from uuid import uuid4
+from types import SimpleNamespace
 
 client = TestClient(app)
 
-# FakeQuery クラスで filter, order_by, all のメソッドチェーンを実装
+# FakeQuery クラスで join, filter, order_by, all のメソッドチェーンを実装
 class FakeQuery:
     def __init__(self, fake_user_id):
         self.fake_user_id = fake_user_id
 
+    def join(self, *args):
+        # 結合条件は無視するが、チェーンの継続
+        return self
+
     def filter(self, *args):
         # 実際のフィルタ条件は無視しているが、メソッドチェーンは継続
         return self
@@ -19,12 +24,12 @@ class FakeQuery:
 
     def all(self):
         return [
-            {
-                "id": str(uuid4()),
-                "user_id": self.fake_user_id,
-                "recommendation": {"title": "Test Title", "description": "Test desc"},
-                "created_at": "2025-02-25T09:14:12.499801"
-            }
+            SimpleNamespace(
+                id=str(uuid4()),
+                user_id=self.fake_user_id,
+                recommendation={"title": "Test Title", "description": "Test desc"},
+                created_at="2025-02-25T09:14:12.499801"
+            )
         ]
 
 # FakeSession クラスで query メソッドが FakeQuery を返すように実装
@@ -32,7 +37,7 @@ class FakeSession:
     def __init__(self, fake_user_id):
         self.fake_user_id = fake_user_id
 
-    def query(self, model):
+    def query(self, *columns):
         return FakeQuery(self.fake_user_id)
 
 def test_get_user_history(monkeypatch):
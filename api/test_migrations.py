@@ -0,0 +1,76 @@
+import uuid
+import sqlalchemy as sa
+from models import Base
+from payloads import payload_hash
+
+IDEA = {"title": "お題", "roadmap": ["a"]}
+
+def seed(engine):
+    """
+    アプリ起動時の create_all と同じく、現在のモデルからテーブルを作って1件入れる
+    """
+    Base.metadata.create_all(bind=engine)
+    h = payload_hash(IDEA)
+    with engine.begin() as conn:
+        conn.execute(sa.text("INSERT INTO recommendation_payloads (hash, payload) VALUES (:h, :p)"), {"h": h, "p": '{"title": "お題", "roadmap": ["a"]}'})
+        conn.execute(
+            sa.text("INSERT INTO recommendations (id, user_id, payload_hash, created_at) VALUES (:id, :user_id, :h, :created_at)"),
+            {"id": uuid.uuid4().hex, "user_id": uuid.uuid4().hex, "h": h, "created_at": "2024-05-01 00:00:00"},
+        )
+    return h
+
+def test_upgrade_after_create_all_sqlite(upgrade_database, tmp_path):
+    url = f"sqlite:///{tmp_path / 'migrate.db'}"
+    engine = sa.create_engine(url)
+    h = seed(engine)
+
+    upgrade_database(url)
+
+    with engine.connect() as conn:
+        assert conn.execute(sa.text("SELECT payload_hash FROM recommendations")).scalars().all() == [h]
+    engine.dispose()
+
+def test_upgrade_backfills_legacy_rows_in_batches(upgrade_database, tmp_path):
+    """
+    recommendation 列に内容を持つ旧スキーマの行を、バッチをまたいで漏れなく移す
+    """
+    url = f"sqlite:///{tmp_path / 'legacy.db'}"
+    engine = sa.create_engine(url)
+    legacy = sa.Table(
+        "recommendations",
+        sa.MetaData(),
+        sa.Column("id", sa.Uuid, primary_key=True),
+        sa.Column("user_id", sa.Uuid, nullable=False),
+        sa.Column("recommendation", sa.JSON, nullable=False),
+        sa.Column("created_at", sa.DateTime),
+    )
+    legacy.create(engine)
+    rows = [{"id": uuid.uuid4(), "user_id": uuid.uuid4(), "recommendation": {"title": f"お題 {i % 300}"}} for i in range(2500)]
+    with engine.begin() as conn:
+        conn.execute(legacy.insert(), rows)
+
+    upgrade_database(url)
+
+    with engine.connect() as conn:
+        hashes = dict(conn.execute(sa.text("SELECT id, payload_hash FROM recommendations")).all())
+        assert conn.execute(sa.text("SELECT count(*) FROM recommendation_payloads")).scalar() == 300
+    assert len(hashes) == 2500
+    assert all(hashes[row["id"].hex] == payload_hash(row["recommendation"]) for row in rows)
+    engine.dispose()
+
+def test_upgrade_after_create_all_postgres(upgrade_database, postgres_url):
+    """
+    create_all で作られた payload_hash 列のテーブルをパーティション化できる
+    """
+    url = postgres_url
+    engine = sa.create_engine(url)
+    h = seed(engine)
+
+    upgrade_database(url)
+
+    with engine.connect() as conn:
+        relkind = conn.execute(sa.text("SELECT relkind FROM pg_class WHERE relname = 'recommendations'")).scalar()
+        assert relkind == "p"
+        assert conn.execute(sa.text("SELECT payload_hash FROM recommendations")).scalars().all() == [h]
+        assert conn.execute(sa.text("SELECT to_regclass('recommendations_legacy')")).scalar() is None
+    engine.dispose()
@@ -0,0 +1,136 @@
+import asyncio
+import datetime
+import uuid
+import partitions
+from partitions import (
+    add_months,
+    ensure_future_partitions,
+    hot_cutoff,
+    parse_partition_name,
+    partition_name,
+    read_archive,
+    write_archive,
+)
+from sqlalchemy import create_engine
+from types import SimpleNamespace
+
+def test_add_months_across_year():
+    assert add_months(datetime.datetime(2024, 11, 15), 3) == datetime.datetime(2025, 2, 1)
+    assert add_months(datetime.datetime(2025, 1, 1), -1) == datetime.datetime(2024, 12, 1)
+
+def test_partition_name_roundtrip():
+    month = datetime.datetime(2025, 3, 1)
+    name = partition_name(month)
+    assert name == "recommendations_y2025m03"
+    assert parse_partition_name(name) == month
+    assert parse_partition_name("recommendations_legacy") is None
+
+def test_hot_cutoff(monkeypatch):
+    monkeypatch.setattr(partitions, "RECOMMENDATION_RETENTION_MONTHS", None)
+    assert hot_cutoff() is None
+    monkeypatch.setattr(partitions, "RECOMMENDATION_RETENTION_MONTHS", "6")
+    assert hot_cutoff(datetime.datetime(2025, 3, 20)) == datetime.datetime(2024, 9, 1)
+
+def test_ensure_future_partitions_noop_on_sqlite():
+    engine = create_engine("sqlite://")
+    assert ensure_future_partitions(engine) == []
+
+def test_ensure_partitions_periodically(monkeypatch):
+    """
+    間隔ごとに作成を繰り返し、失敗しても止まらず、キャンセルで終了する
+    """
+    calls = []
+
+    def fake_ensure(engine):
+        calls.append(engine)
+        if len(calls) == 1:
+            raise RuntimeError("duplicate")
+        return []
+
+    monkeypatch.setattr(partitions, "ensure_future_partitions", fake_ensure)
+
+    async def run():
+        task = asyncio.create_task(partitions.ensure_partitions_periodically("engine", interval=0.01))
+        while len(calls) < 3:
+            await asyncio.sleep(0.01)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        return task
+
+    task = asyncio.run(run())
+    assert task.cancelled()
+    assert calls[:3] == ["engine"] * 3
+
+def test_archive_file_roundtrip(tmp_path):
+    """
+    アーカイブファイルに書き出した行が、DBに戻せる型で読み戻せること
+    """
+    rows = [
+        SimpleNamespace(
+            id=uuid.uuid4(),
+            user_id=uuid.uuid4(),
+            recommendation={"title": f"タイトル{i}"},
+            created_at=datetime.datetime(2024, 1, 1, 0, i),
+        )
+        for i in range(3)
+    ]
+    path = str(tmp_path / "recommendations_y2024m01.ndjson.gz")
+    assert write_archive(path, rows) == 3
+    restored = list(read_archive(path))
+    assert [r["id"] for r in restored] == [r.id for r in rows]
+    assert restored[0]["created_at"] == rows[0].created_at
+    assert restored[2]["recommendation"] == {"title": "タイトル2"}
+
+def test_archive_restore_roundtrip_postgres(postgres_url, upgrade_database, tmp_path):
+    """
+    古い月を切り離してファイルに退避し、そのファイルから同じ行と内容に戻せる
+    """
+    from models import Base, RecommendationModel
+    from payloads import store_payload
+    from sqlalchemy import text
+    from sqlalchemy.orm import Session
+
+    engine = create_engine(postgres_url)
+    Base.metadata.create_all(bind=engine)
+    upgrade_database(postgres_url)
+    old_month = datetime.datetime(2020, 1, 1)
+    with engine.begin() as conn:
+        partitions.create_partition(conn, old_month)
+
+    shared = {"title": "共有のお題"}
+    with Session(engine) as db:
+        old_rows = [
+            RecommendationModel(
+                user_id=uuid.uuid4(),
+                payload_hash=store_payload(db, shared if i % 2 else {"title": f"お題{i}"}),
+                created_at=old_month + datetime.timedelta(days=i),
+            )
+            for i in range(5)
+        ]
+        db.add_all(old_rows)
+        db.add(RecommendationModel(user_id=uuid.uuid4(), payload_hash=store_payload(db, shared)))
+        db.commit()
+        expected = sorted((r.id, r.recommendation["title"]) for r in old_rows)
+
+    def old_month_rows(conn):
+        return sorted(conn.execute(text(
+            "SELECT r.id, p.payload->>'title' FROM recommendations r "
+            "JOIN recommendation_payloads p ON p.hash = r.payload_hash "
+            "WHERE r.created_at < '2020-02-01'"
+        )).all())
+
+    archived = partitions.archive_partitions(engine, older_than_months=12, archive_dir=str(tmp_path))
+    assert archived == [partitions.archive_path(str(tmp_path), old_month)]
+    with engine.connect() as conn:
+        assert old_month_rows(conn) == []
+        assert partition_name(old_month) not in [name for name, _ in partitions.list_partitions(conn)]
+        # 現在の月の行は残っている
+        assert conn.execute(text("SELECT count(*) FROM recommendations")).scalar() == 1
+
+    assert partitions.restore_partition(engine, old_month, archive_dir=str(tmp_path)) == 5
+    with engine.connect() as conn:
+        assert [tuple(row) for row in old_month_rows(conn)] == expected
+    engine.dispose()
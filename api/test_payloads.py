@@ -0,0 +1,27 @@
+from models import Base, RecommendationModel, RecommendationPayload
+from payloads import payload_hash, store_payload
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from uuid import uuid4
+
+def test_payload_hash_ignores_key_order_and_whitespace():
+    assert payload_hash({"title": "a", "roadmap": ["x", "y"]}) == payload_hash({"roadmap": ["x", "y"], "title": "a"})
+    assert payload_hash({"title": "a"}) != payload_hash({"title": "b"})
+
+def test_store_payload_deduplicates():
+    """
+    同じ内容を複数ユーザーが保存しても recommendation_payloads は1行だけ
+    """
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    data = {"title": "同じお題", "description": "desc"}
+    for _ in range(3):
+        db.add(RecommendationModel(user_id=uuid4(), payload_hash=store_payload(db, data)))
+    db.commit()
+
+    assert db.query(RecommendationPayload).count() == 1
+    recs = db.query(RecommendationModel).all()
+    assert len(recs) == 3
+    assert all(rec.recommendation == data for rec in recs)
+    db.close()
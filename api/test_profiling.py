@@ -0,0 +1,88 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+import main
+from main import app
+from profiling import ProfileStore, ProfilingMiddleware
+from uuid import uuid4
+import cProfile
+import pstats
+import sys
+import pytest
+
+def make_client(store, token="secret", sample_rate=0.0):
+    """ミドルウェア付きの小さなアプリ（同期ハンドラーはスレッドプールで動く）"""
+    sample_app = FastAPI()
+
+    def slow_handler_marker():
+        return sum(i * i for i in range(1000))
+
+    @sample_app.get("/history")
+    def history():
+        return {"value": slow_handler_marker()}
+
+    sample_app.add_middleware(ProfilingMiddleware, store=store, token=token, sample_rate=sample_rate)
+    return TestClient(sample_app)
+
+def test_profiles_only_requests_with_debug_header(tmp_path):
+    store = ProfileStore(str(tmp_path), max_files=10)
+    client = make_client(store)
+
+    assert client.get("/history").status_code == 200
+    assert client.get("/history", headers={"X-Debug-Profile": "wrong"}).status_code == 200
+    assert store.list() == []
+
+    assert client.get("/history", headers={"X-Debug-Profile": "secret"}).status_code == 200
+    profiles = store.list()
+    assert len(profiles) == 1
+    assert "GET-history" in profiles[0]["name"]
+
+# cProfile が全スレッドを計測するのは Python 3.12 から（3.11 以前はイベントループのスレッドのみ）
+@pytest.mark.skipif(sys.version_info < (3, 12), reason="Python 3.12 以上が必要")
+def test_profile_includes_threadpool_handler(tmp_path):
+    store = ProfileStore(str(tmp_path), max_files=10)
+    client = make_client(store)
+    client.get("/history", headers={"X-Debug-Profile": "secret"})
+    # スレッドプールで動いた同期ハンドラーも計測されている
+    stats = pstats.Stats(store.path(store.list()[0]["name"]))
+    assert any(func[2] == "slow_handler_marker" for func in stats.stats)
+
+def test_sampling_rate(tmp_path):
+    store = ProfileStore(str(tmp_path), max_files=10)
+    client = make_client(store, token="", sample_rate=1.0)
+    client.get("/history")
+    assert len(store.list()) == 1
+
+def test_ring_buffer_is_bounded(tmp_path):
+    store = ProfileStore(str(tmp_path), max_files=3)
+    for i in range(5):
+        store.save(cProfile.Profile(), "GET", f"/history/{i}", 1.0)
+    names = [p["name"] for p in store.list()]
+    assert len(names) == 3
+    # 新しいものから残る
+    assert "history_4" in names[0]
+    assert store.path("../main.py") is None
+
+def test_admin_profiles_endpoints(monkeypatch, tmp_path, mock_auth):
+    user_id = str(uuid4())
+    mock_auth(user_id)
+    store = ProfileStore(str(tmp_path))
+    name = store.save(cProfile.Profile(), "POST", "/submit_deepseek", 12.0)
+    monkeypatch.setattr(main, "profile_store", store)
+    client = TestClient(app)
+    headers = {"Authorization": "Bearer valid_token"}
+
+    monkeypatch.setenv("ADMIN_USER_IDS", "")
+    response = client.get("/admin/profiles", headers=headers)
+    assert response.status_code == 403
+
+    monkeypatch.setenv("ADMIN_USER_IDS", user_id)
+    response = client.get("/admin/profiles", headers=headers)
+    assert response.status_code == 200
+    assert [p["name"] for p in response.json()["profiles"]] == [name]
+
+    response = client.get(f"/admin/profiles/{name}", headers=headers)
+    assert response.status_code == 200
+    assert response.content == open(store.path(name), "rb").read()
+
+    response = client.get("/admin/profiles/missing.prof", headers=headers)
+    assert response.status_code == 404
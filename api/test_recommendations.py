@@ -22,6 +22,9 @@ class FakeQuery:
     def __init__(self, result):
         self.result = result
 
+    def join(self, *args):
+        return self
+
     def filter(self, *args):
         return self
 
@@ -33,20 +36,27 @@ class FakeSessionValid:
     def __init__(self, recommendation_obj):
         self.recommendation_obj = recommendation_obj
 
-    def query(self, model):
+    def query(self, *columns):
         return FakeQuery(self.recommendation_obj)
 
 # 404エラー用FakeSession
 class FakeSessionNotFound:
-    def query(self, model):
+    def query(self, *columns):
         return FakeQuery(None)
 
 # 403エラー用FakeSession
 class FakeSessionForbidden:
+    """
+    所有者で絞り込んだクエリは見つからず、id だけの存在確認では見つかる
+    """
     def __init__(self, recommendation_obj):
         self.recommendation_obj = recommendation_obj
+        self.queried = []
 
-    def query(self, model):
+    def query(self, *columns):
+        self.queried.append(columns)
+        if len(self.queried) == 1:
+            return FakeQuery(None)
         return FakeQuery(self.recommendation_obj)
 
 # DBファクトリーのオーバーライド用ヘルパー関数
@@ -191,4 +201,67 @@ def test_get_recommendation_detail_invalid_token(monkeypatch):
     response = client.get(f"/recommendations/{rec_id}", headers=headers)
     assert response.status_code == 401
     data = response.json()
-    assert data["detail"] == "Invalid access token"
\ No newline at end of file
+    assert data["detail"] == "Invalid access token"
+
+# DBにアクセスしたら失敗するFakeSession（キャッシュヒットの確認用）
+class FakeSessionUnreachable:
+    def query(self, *columns):
+        raise AssertionError("database should not be queried")
+
+def test_get_recommendation_detail_forbidden_does_not_load_payload(mock_auth):
+    """
+    他人のレコメンドの場合、存在確認は id 列だけで行う
+    """
+    import main
+    mock_auth(str(uuid4()))
+    rec_id = str(uuid4())
+    session = FakeSessionForbidden(FakeRecommendation(rec_id, uuid4(), {"title": "x"}))
+    app.dependency_overrides[get_db] = override_get_db_factory(session)
+
+    response = client.get(f"/recommendations/{rec_id}", headers={"Authorization": "Bearer valid_token"})
+    assert response.status_code == 403
+    assert session.queried[1] == (main.RecommendationModel.id,)
+
+def test_get_recommendation_detail_served_from_cache(mock_auth):
+    """
+    2回目以降の閲覧はDBを見ずにキャッシュから返し、所有者の確認もキャッシュで行う
+    """
+    fake_user_id = str(uuid4())
+    rec_id = str(uuid4())
+    recommendation_data = {"title": "Cached Title", "description": "Cached description"}
+    mock_auth(fake_user_id)
+    headers = {"Authorization": "Bearer valid_token"}
+
+    app.dependency_overrides[get_db] = override_get_db_factory(
+        FakeSessionValid(FakeRecommendation(rec_id, UUID(fake_user_id), recommendation_data))
+    )
+    assert client.get(f"/recommendations/{rec_id}", headers=headers).json() == recommendation_data
+
+    app.dependency_overrides[get_db] = override_get_db_factory(FakeSessionUnreachable())
+    response = client.get(f"/recommendations/{rec_id}", headers=headers)
+    assert response.status_code == 200
+    assert response.json() == recommendation_data
+
+    mock_auth(str(uuid4()))
+    response = client.get(f"/recommendations/{rec_id}", headers=headers)
+    assert response.status_code == 403
+
+def test_recommendation_cache_is_bounded():
+    from cache import RecommendationCache
+    cache = RecommendationCache(max_size=2)
+    owner = uuid4()
+    ids = [uuid4() for _ in range(3)]
+    cache.put(ids[0], owner, {"n": 0})
+    cache.put(ids[1], owner, {"n": 1})
+    cache.get(ids[0])
+    cache.put(ids[2], owner, {"n": 2})
+    # 最近使っていない ids[1] が追い出される
+    assert cache.get(ids[1]) is None
+    assert cache.get(ids[0]) == (owner, {"n": 0})
+    # 削除処理を追加する場合はここで消す
+    cache.invalidate(ids[0])
+    assert cache.get(ids[0]) is None
+
+# テスト終了後、依存関係のオーバーライドをクリア
+def teardown_module(module):
+    app.dependency_overrides = {}
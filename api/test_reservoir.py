@@ -0,0 +1,118 @@
+from fastapi.testclient import TestClient
+import main
+from main import app
+from reservoir import IdeaReservoir, profile_key, validate_idea
+import json
+import time
+
+client = TestClient(app)
+
+def make_idea(i):
+    return {
+        "title": f"Title {i}",
+        "description": "desc",
+        "roadmap": ["step"],
+        "technologies": ["Python"],
+        "outcomes": ["API"],
+    }
+
+def test_profile_key_normalization():
+    a = profile_key(" Backend ", "Python", "初心者向け", ["音楽", "ゲーム"])
+    b = profile_key("backend", "python", "初心者向け", ["ゲーム", "音楽", "音楽"])
+    assert a == b
+    assert a != profile_key("backend", "go", "初心者向け", ["ゲーム", "音楽"])
+
+def test_validate_idea():
+    assert validate_idea(make_idea(0))
+    assert not validate_idea({**make_idea(0), "roadmap": []})
+    assert not validate_idea({**make_idea(0), "title": 1})
+    assert not validate_idea(["not", "a", "dict"])
+    # プロンプトの出力フォーマットの例がそのまま返ってきた場合
+    template = {"title": "string", "description": "string", "roadmap": ["string"], "technologies": ["string"], "outcomes": ["string"]}
+    assert not validate_idea(template)
+    assert not validate_idea({**make_idea(0), "description": " String "})
+    assert not validate_idea({**make_idea(0), "outcomes": ["API", "string"]})
+
+def test_reservoir_pick_take_and_no_repeat():
+    reservoir = IdeaReservoir(ttl=60)
+    ideas = [make_idea(i) for i in range(3)]
+    assert reservoir.pick("k", ideas, "user-a") == ideas[0]
+    # 残りの2つを順に取り出す
+    assert reservoir.take("k", "user-b") == ideas[1]
+    assert reservoir.take("k", "user-b") == ideas[2]
+    assert reservoir.take("k", "user-b") is None
+
+    # 出したことのあるアイデアは同じユーザーには出さない
+    reservoir.pick("k", [make_idea(5), make_idea(6)], "user-c")
+    reservoir.mark_served("user-d", make_idea(6))
+    assert reservoir.take("k", "user-d") is None
+    assert reservoir.take("k", "user-e") == make_idea(6)
+
+def test_reservoir_ttl():
+    reservoir = IdeaReservoir(ttl=0.01)
+    reservoir.pick("k", [make_idea(0), make_idea(1)])
+    time.sleep(0.02)
+    assert reservoir.take("k") is None
+    assert reservoir.stats()["expired"] == 1
+
+def test_reservoir_max_profiles():
+    reservoir = IdeaReservoir(ttl=60, max_profiles=2)
+    reservoir.pick("a", [make_idea(0), make_idea(1), make_idea(2)])
+    reservoir.pick("b", [make_idea(3), make_idea(4)])
+    # a を使ったので、次のプロフィールを追加したときに消えるのは b
+    assert reservoir.take("a") == make_idea(1)
+    reservoir.pick("c", [make_idea(5), make_idea(6)])
+    assert reservoir.stats()["profiles"] == 2
+    assert reservoir.take("b") is None
+    assert reservoir.take("a") == make_idea(2)
+
+def test_reservoir_sweeps_expired_profiles():
+    """
+    二度とリクエストされないプロフィールも、期限が切れたら次の生成時に消える
+    """
+    reservoir = IdeaReservoir(ttl=0.01)
+    for i in range(5):
+        reservoir.pick(f"k{i}", [make_idea(0), make_idea(1)])
+    time.sleep(0.02)
+    reservoir.pick("other", [make_idea(2), make_idea(3)])
+    assert reservoir.stats()["profiles"] == 1
+    assert reservoir.stats()["expired"] == 5
+
+class FakeStreamResponse:
+    def __init__(self, text):
+        self.text = text
+        self.status_code = 200
+        self.headers = {"Content-Type": "text/plain"}
+        self.encoding = "utf-8"
+
+    def iter_content(self, chunk_size=None, decode_unicode=False):
+        yield self.text
+
+    def close(self):
+        pass
+
+def test_submit_deepseek_uses_reservoir(monkeypatch):
+    """
+    3個まとめて生成し、同じプロフィールの次の2回はLLMを呼ばずに返す
+    """
+    monkeypatch.setenv("DEEPSEEK_IDEAS_PER_CALL", "3")
+    monkeypatch.setattr(main, "idea_reservoir", IdeaReservoir(ttl=60))
+    ideas = [make_idea(i) for i in range(3)] + [{"title": "invalid"}]
+    prompts = []
+
+    def mock_post(url, **kwargs):
+        prompts.append(kwargs["json"]["text"])
+        return FakeStreamResponse("</think>```json\n" + json.dumps(ideas, ensure_ascii=False) + "\n```")
+
+    monkeypatch.setattr("requests.post", mock_post)
+    payload = {
+        "engineerType": "バックエンド",
+        "programmingLanguage": "Python",
+        "learningPreference": "初心者向け",
+        "interestFields": ["音楽"],
+    }
+    results = [client.post("/submit_deepseek", json=payload).json() for _ in range(4)]
+
+    assert results[:3] == ideas[:3]
+    assert len(prompts) == 2
+    assert "3個のアイデア" in prompts[0]